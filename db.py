@@ -2,16 +2,69 @@
 
 import json
 import sqlite3
+import sys
+from itertools import islice
+from operator import itemgetter
+from urllib.parse import quote
 
-import pandas as pd
+# SQLite's default SQLITE_MAX_VARIABLE_NUMBER on older builds
+_MAX_PARAMS = 999
+
+# Per-program DELETEs. sqlite3 caches prepared statements per connection keyed
+# by SQL text, so sharing one string per statement means it is compiled once.
+_SQL_DELETE_TABLE_OPS = "DELETE FROM table_operations WHERE program_path = ?"
+_SQL_DELETE_DEPENDENCIES = "DELETE FROM program_dependencies WHERE source_program = ?"
+_SQL_DELETE_PROGRAM = "DELETE FROM programs WHERE program_path = ?"
+_SQL_DELETE_MACRO_DEFS = "DELETE FROM macro_definitions WHERE program_path = ?"
+
+# Column order of the plain tuples the upsert functions accept
+PROGRAM_COLUMNS = (
+    "program_path", "file_size", "file_mtime", "file_atime", "file_uid",
+    "file_gid", "file_mode", "owner", "scan_timestamp", "credential_findings",
+    "content_hash",
+)
+TABLE_OPERATION_COLUMNS = (
+    "program_path", "table_name", "database_type", "operation_type", "source_line", "in_scope",
+)
+DEPENDENCY_COLUMNS = ("source_program", "target_program", "dependency_type")
+LIBNAME_COLUMNS = ("libref", "engine", "source")
+
+
+def _insert_or_replace_sql(table_name, columns):
+    return (f"INSERT OR REPLACE INTO {table_name} ({', '.join(columns)}) "
+            f"VALUES ({', '.join(['?'] * len(columns))})")
+
+
+# Single-row upserts for tuple rows, run through executemany
+_SQL_INSERT_PROGRAM = _insert_or_replace_sql("programs", PROGRAM_COLUMNS)
+_SQL_INSERT_LIBNAME = _insert_or_replace_sql("libname_mappings", LIBNAME_COLUMNS)
+
+# Natural keys of the per-program child tables (owner column first); they
+# back the UNIQUE indexes used by ON CONFLICT.
+_TABLE_OPS_KEY = ("program_path", "table_name", "operation_type", "source_line")
+_DEPS_KEY = ("source_program", "target_program", "dependency_type")
 
 
 def init_db(path):
     """Create SQLite database with schema. Returns connection."""
     conn = sqlite3.connect(path)
     conn.execute("PRAGMA journal_mode=WAL")
+    # WAL makes synchronous=NORMAL durable across application crashes and
+    # drops the fsync on every commit; the larger page cache and mmap keep
+    # the indexes hot for the scan upserts and impact queries.
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=10737418240")
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA busy_timeout=5000")
     conn.execute("PRAGMA foreign_keys=ON")
 
+    # program_edges used to hold TEXT paths; it is derived, so drop it and
+    # let the backfill below rebuild it with interned ids
+    edge_cols = {row[1] for row in conn.execute("PRAGMA table_info(program_edges)")}
+    if "source" in edge_cols:
+        conn.execute("DROP TABLE program_edges")
+
     conn.executescript("""
         CREATE TABLE IF NOT EXISTS programs (
             program_path    TEXT PRIMARY KEY,
@@ -23,7 +76,8 @@ def init_db(path):
             file_mode       INTEGER,
             owner           TEXT,
             scan_timestamp  TEXT NOT NULL,
-            credential_findings TEXT
+            credential_findings TEXT,
+            content_hash    TEXT
         );
 
         CREATE TABLE IF NOT EXISTS table_operations (
@@ -43,80 +97,438 @@ def init_db(path):
             dependency_type TEXT NOT NULL
         );
 
+        -- Macro catalog: macros defined by files in the macro directory
+        CREATE TABLE IF NOT EXISTS macro_definitions (
+            macro_name      TEXT NOT NULL,
+            program_path    TEXT NOT NULL,
+            PRIMARY KEY (macro_name, program_path)
+        );
+        CREATE INDEX IF NOT EXISTS idx_macro_defs_path
+            ON macro_definitions(program_path);
+
         CREATE TABLE IF NOT EXISTS libname_mappings (
             libref          TEXT PRIMARY KEY,
             engine          TEXT NOT NULL,
             source          TEXT NOT NULL DEFAULT 'parsed'
         );
 
-        CREATE INDEX IF NOT EXISTS idx_table_ops_program
-            ON table_operations(program_path);
-        CREATE INDEX IF NOT EXISTS idx_table_ops_table
-            ON table_operations(table_name);
+        -- Program paths interned to integer ids for the derived edge table
+        CREATE TABLE IF NOT EXISTS paths (
+            id              INTEGER PRIMARY KEY,
+            path            TEXT NOT NULL UNIQUE
+        );
+
+        -- Derived program → program impact edges, rebuilt after each scan.
+        -- A change to source impacts target.
+        CREATE TABLE IF NOT EXISTS program_edges (
+            source_id       INTEGER NOT NULL REFERENCES paths(id),
+            target_id       INTEGER NOT NULL REFERENCES paths(id),
+            via_table       TEXT NOT NULL DEFAULT '',
+            kind            TEXT NOT NULL,
+            PRIMARY KEY (source_id, target_id, via_table)
+        ) WITHOUT ROWID;
+
+        CREATE INDEX IF NOT EXISTS idx_edges_target
+            ON program_edges(target_id);
+
+        -- program_edges with paths spelled out, for ad hoc queries
+        CREATE VIEW IF NOT EXISTS program_edge_paths AS
+            SELECT s.path AS source, t.path AS target, e.via_table, e.kind
+            FROM program_edges e
+            JOIN paths s ON s.id = e.source_id
+            JOIN paths t ON t.id = e.target_id;
+
         CREATE INDEX IF NOT EXISTS idx_table_ops_type
             ON table_operations(operation_type);
-        CREATE INDEX IF NOT EXISTS idx_deps_source
-            ON program_dependencies(source_program);
-        CREATE INDEX IF NOT EXISTS idx_deps_target
-            ON program_dependencies(target_program);
+
+        -- Covering indexes for the impact-query joins: each holds the join
+        -- predicate plus the projected column, so lookups never touch the table.
+        CREATE INDEX IF NOT EXISTS idx_table_ops_tname_op
+            ON table_operations(table_name, operation_type, program_path);
+        CREATE INDEX IF NOT EXISTS idx_table_ops_path_op
+            ON table_operations(program_path, operation_type, table_name);
+        CREATE INDEX IF NOT EXISTS idx_deps_target_source
+            ON program_dependencies(target_program, source_program);
+        CREATE INDEX IF NOT EXISTS idx_deps_source_target
+            ON program_dependencies(source_program, target_program);
+
+        -- Superseded by the covering indexes above (same leading column)
+        DROP INDEX IF EXISTS idx_table_ops_program;
+        DROP INDEX IF EXISTS idx_table_ops_table;
+        DROP INDEX IF EXISTS idx_deps_source;
+        DROP INDEX IF EXISTS idx_deps_target;
     """)
     conn.commit()
+
+    program_cols = {row[1] for row in conn.execute("PRAGMA table_info(programs)")}
+    if "content_hash" not in program_cols:
+        conn.execute("ALTER TABLE programs ADD COLUMN content_hash TEXT")
+        conn.commit()
+
+    # Natural keys. Rows written before these indexes existed may repeat a
+    # key: keep the first copy so the unique indexes can be built.
+    has_natural_keys = conn.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' "
+        "AND name IN ('uq_table_ops_natural', 'uq_deps_natural')"
+    ).fetchone()[0] == 2
+    if not has_natural_keys:
+        conn.executescript("""
+            DELETE FROM table_operations WHERE id NOT IN (
+                SELECT MIN(id) FROM table_operations
+                GROUP BY program_path, table_name, operation_type, source_line
+            );
+            DELETE FROM program_dependencies WHERE id NOT IN (
+                SELECT MIN(id) FROM program_dependencies
+                GROUP BY source_program, target_program, dependency_type
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_table_ops_natural
+                ON table_operations(program_path, table_name, operation_type, source_line);
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_deps_natural
+                ON program_dependencies(source_program, target_program, dependency_type);
+        """)
+        conn.commit()
+
+    # Databases scanned before program_edges existed: derive it once
+    needs_edges = conn.execute("""
+        SELECT NOT EXISTS (SELECT 1 FROM program_edges)
+           AND (EXISTS (SELECT 1 FROM table_operations)
+                OR EXISTS (SELECT 1 FROM program_dependencies))
+    """).fetchone()[0]
+    if needs_edges:
+        rebuild_program_edges(conn)
+        conn.commit()
+    return conn
+
+
+def open_readonly(path):
+    """Open an existing database read-only. Returns connection.
+
+    Read-only connections never take the writer lock, so queries can run
+    while a scan is writing. The schema is not created or migrated: run a
+    scan (or init_db) first.
+    """
+    conn = sqlite3.connect(f"file:{quote(str(path))}?mode=ro", uri=True)
+    conn.execute("PRAGMA query_only=ON")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=10737418240")
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA busy_timeout=5000")
     return conn
 
 
+def begin(conn):
+    """Start a write transaction (BEGIN IMMEDIATE) unless one is already open.
+
+    Takes the writer lock up front so a batch never fails half way through
+    upgrading from a read lock. Commit with conn.commit() or `with conn:`.
+    """
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+
+
+def rebuild_program_edges(conn):
+    """Recompute program_edges from table_operations and program_dependencies.
+
+    Data edges run from the program that creates a table to each program that
+    reads it; dependency edges run from the included/called program to the
+    program that includes/calls it. Paths no edge refers to are dropped from
+    the paths table.
+    """
+    conn.execute("DELETE FROM program_edges")
+    conn.execute("""
+        INSERT OR IGNORE INTO paths (path)
+        SELECT program_path FROM table_operations
+        UNION SELECT source_program FROM program_dependencies
+        UNION SELECT target_program FROM program_dependencies
+    """)
+    conn.execute("""
+        INSERT OR IGNORE INTO program_edges (source_id, target_id, via_table, kind)
+        SELECT DISTINCT ps.id, pt.id, w.table_name, 'data'
+        FROM table_operations w
+        JOIN table_operations r
+          ON r.table_name = w.table_name AND r.operation_type = 'read'
+        JOIN paths ps ON ps.path = w.program_path
+        JOIN paths pt ON pt.path = r.program_path
+        WHERE w.operation_type = 'create'
+          AND w.program_path != r.program_path
+    """)
+    conn.execute("""
+        INSERT OR IGNORE INTO program_edges (source_id, target_id, via_table, kind)
+        SELECT DISTINCT ps.id, pt.id, '', d.dependency_type
+        FROM program_dependencies d
+        JOIN paths ps ON ps.path = d.target_program
+        JOIN paths pt ON pt.path = d.source_program
+        WHERE d.target_program != d.source_program
+    """)
+    conn.execute("""
+        DELETE FROM paths WHERE id NOT IN (
+            SELECT source_id FROM program_edges UNION SELECT target_id FROM program_edges
+        )
+    """)
+
+
+def optimize_db(conn):
+    """Let SQLite refresh planner statistics for tables that need it."""
+    conn.execute("PRAGMA optimize")
+
+
+def close_db(conn):
+    """Run PRAGMA optimize and close the connection."""
+    try:
+        optimize_db(conn)
+    finally:
+        conn.close()
+
+
 def get_scan_state(conn):
     """Return {program_path: mtime} for all previously scanned files."""
-    cursor = conn.execute("SELECT program_path, file_mtime FROM programs")
-    return {row[0]: row[1] for row in cursor.fetchall()}
+    return dict(conn.execute("SELECT program_path, file_mtime FROM programs"))
+
+
+def get_content_state(conn):
+    """Return {program_path: (file_size, content_hash)} for files scanned with a hash."""
+    return {
+        path: (size, content_hash)
+        for path, size, content_hash in conn.execute(
+            "SELECT program_path, file_size, content_hash FROM programs"
+            " WHERE content_hash IS NOT NULL"
+        )
+    }
+
+
+def touch_programs(conn, rows):
+    """Record new stat times for programs whose content did not change.
 
+    rows: (file_mtime, file_atime, scan_timestamp, program_path) tuples.
+    """
+    conn.executemany(
+        "UPDATE programs SET file_mtime = ?, file_atime = ?, scan_timestamp = ?"
+        " WHERE program_path = ?",
+        rows,
+    )
 
-def upsert_programs(conn, df):
-    """Insert or replace program records from a DataFrame."""
-    if df.empty:
+
+def upsert_programs(conn, rows):
+    """Insert or replace program records.
+
+    rows: list of tuples in PROGRAM_COLUMNS order, or a DataFrame whose
+    columns name the fields to write.
+    """
+    if _is_dataframe(rows):
+        _insert_or_replace(conn, "programs", PROGRAM_COLUMNS, rows)
+    else:
+        conn.executemany(_SQL_INSERT_PROGRAM, rows)
+
+
+def _is_dataframe(obj):
+    """isinstance(obj, pandas.DataFrame), without importing pandas.
+
+    If pandas was never imported, obj cannot be a DataFrame, so scans that
+    pass plain tuples never pay pandas' import time.
+    """
+    pd = sys.modules.get("pandas")
+    return pd is not None and isinstance(obj, pd.DataFrame)
+
+
+def _as_rows(data, columns):
+    """Return (columns, row tuples) for a list of tuples or a DataFrame.
+
+    Tuples are taken to be in `columns` order; a DataFrame supplies its own
+    column names.
+    """
+    if _is_dataframe(data):
+        return list(data.columns), data.itertuples(index=False, name=None)
+    return list(columns), data
+
+
+def _insert_or_replace(conn, table_name, columns, data):
+    """INSERT OR REPLACE every row of a tuple list or DataFrame."""
+    if len(data) == 0:
         return
-    df.to_sql("programs", conn, if_exists="append", index=False,
-              method=_upsert_method("programs"))
-
-
-def _upsert_method(table_name):
-    """Return a callable for pandas to_sql that does INSERT OR REPLACE."""
-    def method(pd_table, conn, keys, data_iter):
-        cols = ", ".join(keys)
-        placeholders = ", ".join(["?"] * len(keys))
-        sql = f"INSERT OR REPLACE INTO {table_name} ({cols}) VALUES ({placeholders})"
-        data = list(data_iter)
-        conn.executemany(sql, data)
-    return method
-
-
-def upsert_table_operations(conn, program_path, df):
-    """Replace all table operations for a given program path."""
-    conn.execute("DELETE FROM table_operations WHERE program_path = ?", (program_path,))
-    if not df.empty:
-        df.to_sql("table_operations", conn, if_exists="append", index=False)
-    conn.commit()
+    cols, rows = _as_rows(data, columns)
+    _bulk_insert(conn, table_name, cols, rows)
 
 
-def upsert_program_dependencies(conn, program_path, df):
-    """Replace all dependencies for a given source program."""
-    conn.execute("DELETE FROM program_dependencies WHERE source_program = ?", (program_path,))
-    if not df.empty:
-        df.to_sql("program_dependencies", conn, if_exists="append", index=False)
-    conn.commit()
+def _bulk_insert(conn, table_name, cols, rows, chunk=500, on_conflict=None):
+    """INSERT rows using multi-row VALUES statements.
+
+    rows may be any iterable of tuples; it is consumed one chunk at a time.
+    Rows are inserted OR REPLACE unless an on_conflict upsert clause is given.
+    Each statement carries up to `chunk` rows, capped so the number of bound
+    parameters stays within _MAX_PARAMS. Leftover rows go through the
+    single-row statement rather than a one-off VALUES list, so only two
+    distinct statements per table ever reach the statement cache.
+    """
+    chunk = max(1, min(chunk, _MAX_PARAMS // len(cols)))
+    verb = "INSERT OR REPLACE" if on_conflict is None else "INSERT"
+    suffix = "" if on_conflict is None else " " + on_conflict
+    prefix = f"{verb} INTO {table_name} ({', '.join(cols)}) VALUES "
+    row_sql = "(" + ", ".join(["?"] * len(cols)) + ")"
+    full_sql = prefix + ", ".join([row_sql] * chunk) + suffix
+
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, chunk))
+        if len(batch) < chunk:
+            break
+        conn.execute(full_sql, [value for row in batch for value in row])
+    if batch:
+        conn.executemany(prefix + row_sql + suffix, batch)
+
+
+def upsert_table_operations(conn, program_path, rows):
+    """Replace all table operations for a given program path.
+
+    rows: list of tuples in TABLE_OPERATION_COLUMNS order, or a DataFrame.
+    """
+    _sync_rows(conn, "table_operations", TABLE_OPERATION_COLUMNS, _TABLE_OPS_KEY,
+               [(program_path, rows)])
+
+
+def upsert_program_dependencies(conn, program_path, rows):
+    """Replace all dependencies for a given source program.
+
+    rows: list of tuples in DEPENDENCY_COLUMNS order, or a DataFrame.
+    """
+    _sync_rows(conn, "program_dependencies", DEPENDENCY_COLUMNS, _DEPS_KEY,
+               [(program_path, rows)])
+
 
+def upsert_table_operations_bulk(conn, items):
+    """Replace table operations for many programs in one transaction.
 
-def upsert_libname_mappings(conn, df):
-    """Insert or replace libname mappings."""
-    if df.empty:
+    items: iterable of (program_path, rows) pairs, rows as for
+    upsert_table_operations.
+    """
+    begin(conn)
+    with conn:
+        _sync_rows(conn, "table_operations", TABLE_OPERATION_COLUMNS, _TABLE_OPS_KEY, items)
+
+
+def upsert_program_dependencies_bulk(conn, items):
+    """Replace dependencies for many source programs in one transaction.
+
+    items: iterable of (program_path, rows) pairs, rows as for
+    upsert_program_dependencies.
+    """
+    begin(conn)
+    with conn:
+        _sync_rows(conn, "program_dependencies", DEPENDENCY_COLUMNS, _DEPS_KEY, items)
+
+
+def _sync_rows(conn, table_name, columns, key_cols, items):
+    """Make the rows owned by each program match the given rows.
+
+    The first key column names the owning program. Existing rows are diffed
+    against the incoming ones by natural key: unchanged rows are left in
+    place, stale rows are deleted by id, and only new or changed rows are
+    written with INSERT ... ON CONFLICT DO UPDATE. Rescans of mostly
+    unchanged files therefore touch few index pages.
+    """
+    items = list(items)
+    if not items:
         return
-    df.to_sql("libname_mappings", conn, if_exists="append", index=False,
-              method=_upsert_method("libname_mappings"))
-    conn.commit()
+    cols = list(columns)
+    owner_col = key_cols[0]
+    key_of = itemgetter(*[cols.index(c) for c in key_cols])
+    value_cols = [c for c in cols if c not in key_cols]
+
+    incoming = {}
+    for _, data in items:
+        if len(data) == 0:
+            continue
+        if _is_dataframe(data):
+            data = data[cols].itertuples(index=False, name=None)
+        for row in data:
+            incoming[key_of(row)] = tuple(row)
+
+    existing = {}
+    owners = [owner for owner, _ in items]
+    for i in range(0, len(owners), _MAX_PARAMS):
+        chunk = owners[i:i + _MAX_PARAMS]
+        placeholders = ", ".join(["?"] * len(chunk))
+        for row in conn.execute(
+            f"SELECT id, {', '.join(cols)} FROM {table_name} WHERE {owner_col} IN ({placeholders})",
+            chunk,
+        ):
+            existing[key_of(row[1:])] = (row[0], row[1:])
+
+    stale = [row_id for key, (row_id, _) in existing.items() if key not in incoming]
+    for i in range(0, len(stale), _MAX_PARAMS):
+        chunk = stale[i:i + _MAX_PARAMS]
+        placeholders = ", ".join(["?"] * len(chunk))
+        conn.execute(f"DELETE FROM {table_name} WHERE id IN ({placeholders})", chunk)
+
+    changed = (
+        row for key, row in incoming.items()
+        if key not in existing or existing[key][1] != row
+    )
+    if value_cols:
+        updates = ", ".join(f"{c} = excluded.{c}" for c in value_cols)
+        on_conflict = f"ON CONFLICT ({', '.join(key_cols)}) DO UPDATE SET {updates}"
+    else:
+        on_conflict = "ON CONFLICT DO NOTHING"
+    _bulk_insert(conn, table_name, cols, changed, on_conflict=on_conflict)
+
+
+def get_macro_definitions(conn):
+    """Return {program_path: [macro_name, ...]} for the stored macro catalog."""
+    defs = {}
+    for name, path in conn.execute("SELECT macro_name, program_path FROM macro_definitions"):
+        defs.setdefault(path, []).append(name)
+    return defs
+
+
+def upsert_macro_definitions(conn, program_path, macro_names):
+    """Replace the macros a macro-directory file defines."""
+    conn.execute(_SQL_DELETE_MACRO_DEFS, (program_path,))
+    if macro_names:
+        conn.executemany(
+            "INSERT OR IGNORE INTO macro_definitions (macro_name, program_path) VALUES (?, ?)",
+            [(name, program_path) for name in macro_names],
+        )
+
+
+def upsert_libname_mappings(conn, rows):
+    """Insert or replace libname mappings.
+
+    rows: list of tuples in LIBNAME_COLUMNS order, or a DataFrame.
+    """
+    if _is_dataframe(rows):
+        _insert_or_replace(conn, "libname_mappings", LIBNAME_COLUMNS, rows)
+    else:
+        conn.executemany(_SQL_INSERT_LIBNAME, rows)
 
 
 def clear_program(conn, path):
     """Remove a program and all its related records (for deleted files)."""
-    conn.execute("DELETE FROM table_operations WHERE program_path = ?", (path,))
-    conn.execute("DELETE FROM program_dependencies WHERE source_program = ?", (path,))
-    conn.execute("DELETE FROM programs WHERE program_path = ?", (path,))
-    conn.commit()
+    conn.execute(_SQL_DELETE_TABLE_OPS, (path,))
+    conn.execute(_SQL_DELETE_DEPENDENCIES, (path,))
+    conn.execute(_SQL_DELETE_PROGRAM, (path,))
+    conn.execute(_SQL_DELETE_MACRO_DEFS, (path,))
+    conn.execute(
+        "DELETE FROM program_edges WHERE source_id = (SELECT id FROM paths WHERE path = ?1)"
+        " OR target_id = (SELECT id FROM paths WHERE path = ?1)",
+        (path,),
+    )
+
+
+def clear_programs(conn, paths):
+    """clear_program for many paths, with one DELETE per table per chunk of paths."""
+    paths = list(paths)
+    for i in range(0, len(paths), _MAX_PARAMS):
+        chunk = paths[i:i + _MAX_PARAMS]
+        # Numbered parameters, so the edges statement can use the list twice
+        placeholders = ", ".join(f"?{n}" for n in range(1, len(chunk) + 1))
+        conn.execute(f"DELETE FROM table_operations WHERE program_path IN ({placeholders})", chunk)
+        conn.execute(
+            f"DELETE FROM program_dependencies WHERE source_program IN ({placeholders})", chunk
+        )
+        conn.execute(f"DELETE FROM programs WHERE program_path IN ({placeholders})", chunk)
+        conn.execute(f"DELETE FROM macro_definitions WHERE program_path IN ({placeholders})", chunk)
+        conn.execute(
+            f"DELETE FROM program_edges"
+            f" WHERE source_id IN (SELECT id FROM paths WHERE path IN ({placeholders}))"
+            f" OR target_id IN (SELECT id FROM paths WHERE path IN ({placeholders}))",
+            chunk,
+        )
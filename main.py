@@ -6,25 +6,52 @@ import os
 import sys
 from pathlib import Path
 
-import pandas as pd
-
-from scanner import scan, load_config
-from db import init_db
-from queries import downstream_impact, upstream_dependencies, table_impact, credential_report
+from scanner import FETCH_WORKERS, scan, load_config
+from db import init_db, open_readonly
+from queries import downstream_impact, upstream_dependencies, table_impact, iter_credential_findings
 
 
 def _get_db_conn(config_path=None):
-    """Open a read-only connection to the scan database."""
+    """Open a read-only connection to the scan database.
+
+    Exits with a message if no scan has created the database yet. A
+    database written by an older version is opened once through init_db
+    first, so its schema is migrated and the derived tables backfilled.
+    """
     config = load_config(config_path)
     db_path = config.get("database", "sas_mapper.db")
     if not os.path.isabs(db_path):
         db_path = str(Path(__file__).parent / db_path)
-    return init_db(db_path)
+    if not os.path.exists(db_path):
+        sys.exit(f"No scan database at {db_path}; run `scan` first.")
+    conn = open_readonly(db_path)
+    if not _has_current_schema(conn):
+        conn.close()
+        init_db(db_path).close()
+        conn = open_readonly(db_path)
+    return conn
+
+
+def _has_current_schema(conn):
+    """True if the database has the tables the queries read (paths came last)."""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'paths'"
+    ).fetchone() is not None
+
+
+def _format_rows(columns, rows):
+    """Render rows as right-aligned text columns under a header line."""
+    cells = [[str(c) for c in columns]] + [[str(v) for v in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(columns))]
+    return "\n".join(
+        " ".join(value.rjust(width) for value, width in zip(row, widths)) for row in cells
+    )
 
 
 def cmd_scan(args):
     logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
-    stats = scan(config_path=args.config, full=args.full)
+    stats = scan(config_path=args.config, full=args.full, workers=args.workers,
+                 fetch_workers=args.fetch_workers)
     print(f"\nScan complete:")
     print(f"  Scanned: {stats['scanned']}")
     print(f"  Skipped: {stats['skipped']} (unchanged)")
@@ -35,12 +62,12 @@ def cmd_scan(args):
 def cmd_impact(args):
     conn = _get_db_conn(args.config)
     try:
-        result = downstream_impact(conn, args.path)
-        if result.empty:
+        columns, rows = downstream_impact(conn, args.path, as_dataframe=False)
+        if not rows:
             print(f"No downstream impact found for {args.path}")
         else:
             print(f"Downstream impact for {args.path}:\n")
-            print(result.to_string(index=False))
+            print(_format_rows(columns, rows))
     finally:
         conn.close()
 
@@ -48,12 +75,12 @@ def cmd_impact(args):
 def cmd_upstream(args):
     conn = _get_db_conn(args.config)
     try:
-        result = upstream_dependencies(conn, args.path)
-        if result.empty:
+        columns, rows = upstream_dependencies(conn, args.path, as_dataframe=False)
+        if not rows:
             print(f"No upstream dependencies found for {args.path}")
         else:
             print(f"Upstream dependencies for {args.path}:\n")
-            print(result.to_string(index=False))
+            print(_format_rows(columns, rows))
     finally:
         conn.close()
 
@@ -61,12 +88,12 @@ def cmd_upstream(args):
 def cmd_table(args):
     conn = _get_db_conn(args.config)
     try:
-        result = table_impact(conn, args.name)
-        if result.empty:
+        columns, rows = table_impact(conn, args.name, as_dataframe=False)
+        if not rows:
             print(f"No programs found for table {args.name}")
         else:
             print(f"Programs using table {args.name}:\n")
-            print(result.to_string(index=False))
+            print(_format_rows(columns, rows))
     finally:
         conn.close()
 
@@ -74,14 +101,15 @@ def cmd_table(args):
 def cmd_credentials(args):
     conn = _get_db_conn(args.config)
     try:
-        result = credential_report(conn)
-        if result.empty:
+        found = False
+        for program_path, findings in iter_credential_findings(conn):
+            if not found:
+                print(f"Programs with hardcoded credentials:\n")
+                found = True
+            print(f"  {program_path}")
+            print(f"    Findings: {findings}")
+        if not found:
             print("No hardcoded credentials found.")
-        else:
-            print(f"Programs with hardcoded credentials:\n")
-            for _, row in result.iterrows():
-                print(f"  {row['program_path']}")
-                print(f"    Findings: {row['credential_findings']}")
     finally:
         conn.close()
 
@@ -99,6 +127,11 @@ def main():
     # scan
     p_scan = sub.add_parser("scan", help="Scan SFTP for SAS programs")
     p_scan.add_argument("--full", action="store_true", help="Full rescan (ignore mtime)")
+    p_scan.add_argument("--workers", type=int, default=1,
+                        help="Parse files in N worker processes; 0 = one per CPU "
+                             "(default: 1, in-process)")
+    p_scan.add_argument("--fetch-workers", type=int, default=FETCH_WORKERS,
+                        help=f"Read files over N SFTP channels in parallel (default: {FETCH_WORKERS})")
     p_scan.set_defaults(func=cmd_scan)
 
     # impact (downstream)
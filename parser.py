@@ -1,50 +1,404 @@
 """SAS parser — loads regex from patterns.yaml, applies to source text."""
 
+import os
 import re
+import struct
+from bisect import bisect_right
+from functools import lru_cache
 from pathlib import Path
 
 import yaml
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader
+
+try:
+    import hyperscan
+except ImportError:  # optional: falls back to the per-category re union
+    hyperscan = None
+
+
+# Category match count from which line numbers are looked up with one
+# numpy searchsorted call instead of a bisect per match
+_VECTORIZE_MIN_MATCHES = 1024
+
+# Inline flags allowed in a scoped group (?imsx:...)
+_SCOPED_FLAGS = (("i", re.IGNORECASE), ("m", re.MULTILINE), ("s", re.DOTALL), ("x", re.VERBOSE))
+
 
 def load_patterns(yaml_path=None):
     """Load and compile all regex patterns from patterns.yaml.
 
-    Returns dict: category_name → list of compiled pattern dicts.
-    Each dict has: name, regex (compiled), groups (index→semantic name).
+    Returns a PatternSet, a dict of category_name → {"any", "hs", "patterns"}.
+    patterns is the list of pattern dicts, each with: name, regex (compiled),
+    groups (index→semantic name).
+    "any" is a union regex that matches wherever at least one pattern in the
+    category matches, so a single search can rule the whole category out.
+    "hs" is a Hyperscan prefilter database when the hyperscan package is
+    installed (None otherwise): one scan reports which patterns can match.
+
+    The PatternSet's hs attribute is one Hyperscan database over every
+    category (used by parse_all; None without hyperscan), and its hs_index
+    maps each of that database's pattern ids to (category, index into the
+    category's patterns).
+
+    Results are memoized per (path, mtime), so repeated calls return the
+    same dict until the file changes. Hyperscan databases take seconds to
+    compile, so they are also cached on disk next to the YAML file.
     """
     if yaml_path is None:
         yaml_path = Path(__file__).parent / "patterns.yaml"
-    with open(yaml_path) as f:
-        raw = yaml.safe_load(f)
+    path = os.path.abspath(yaml_path)
+    return _load_patterns(path, os.stat(path).st_mtime_ns)
+
 
-    compiled = {}
+@lru_cache(maxsize=None)
+def _load_patterns(path, mtime_ns):
+    with open(path) as f:
+        raw = yaml.load(f, Loader=SafeLoader)
+
+    hs_cache = _read_hs_cache(path, mtime_ns)
+    hs_blobs = {}
+    compiled = PatternSet()
     for category, entries in raw.items():
-        compiled[category] = []
+        pattern_list = []
         for entry in entries:
             flags = 0
             for flag_name in entry.get("flags", []):
                 flags |= getattr(re, flag_name)
-            compiled[category].append({
+            pattern_list.append({
                 "name": entry["name"],
                 "regex": re.compile(entry["pattern"], flags),
                 "groups": {int(k): v for k, v in entry["groups"].items()},
             })
+
+        compiled[category] = {
+            "any": _compile_union(pattern_list),
+            "hs": _cached_hyperscan(category, pattern_list, hs_cache, hs_blobs),
+            "patterns": pattern_list,
+        }
+
+    # One database over all categories; pattern id i is compiled.hs_index[i]
+    compiled.hs_index = [
+        (category, i)
+        for category, entry in compiled.items()
+        for i in range(len(entry["patterns"]))
+    ]
+    compiled.hs = _cached_hyperscan(
+        None, [compiled[category]["patterns"][i] for category, i in compiled.hs_index],
+        hs_cache, hs_blobs,
+    )
+
+    if hyperscan is not None and hs_blobs != hs_cache:
+        _write_hs_cache(path, mtime_ns, hs_blobs)
     return compiled
 
 
+class PatternSet(dict):
+    """category → compiled category dict, plus the all-category Hyperscan database.
+
+    hs is that database (None without hyperscan) and hs_index maps each of
+    its pattern ids to (category, index into the category's patterns).
+    """
+
+    hs = None
+    hs_index = ()
+
+
+def _cached_hyperscan(key, pattern_list, hs_cache, hs_blobs):
+    """Load the Hyperscan database for key from hs_cache, or compile it; record it in hs_blobs."""
+    hs_db = None
+    if key in hs_cache:
+        hs_db = _load_hyperscan(hs_cache[key])
+    if hs_db is not None:
+        hs_blobs[key] = hs_cache[key]
+    else:
+        hs_db = _compile_hyperscan(pattern_list)
+        if hs_db is not None:
+            hs_blobs[key] = hyperscan.dumpb(hs_db)
+    return hs_db
+
+
+def _hs_cache_path(yaml_path):
+    return yaml_path + ".compiled.hsdb"
+
+
+# Cache file layout: magic line, signature line, then one record per
+# database: key length, key (UTF-8 category name), blob length, and the
+# hyperscan.dumpb bytes. Nothing in it is ever executed or unpickled.
+_HS_CACHE_MAGIC = b"dep_map hyperscan cache 1\n"
+_HS_KEY_LEN = struct.Struct(">H")
+_HS_BLOB_LEN = struct.Struct(">Q")
+# Key length marking the all-category database (key None)
+_HS_NO_KEY = 0xFFFF
+
+
+def _hs_cache_header(mtime_ns):
+    """Magic plus a plain-text signature tying the cache to one YAML mtime and hyperscan version."""
+    return _HS_CACHE_MAGIC + f"{mtime_ns} {hyperscan.__version__}\n".encode("utf-8")
+
+
+def _read_hs_cache(yaml_path, mtime_ns):
+    """Return {category: serialized Hyperscan db} cached for this YAML file, or {}.
+
+    The all-category database is stored under the key None. A missing,
+    stale or malformed cache file reads as empty.
+    """
+    if hyperscan is None:
+        return {}
+    try:
+        with open(_hs_cache_path(yaml_path), "rb") as f:
+            data = f.read()
+    except OSError:
+        return {}
+    header = _hs_cache_header(mtime_ns)
+    if not data.startswith(header):
+        return {}
+    try:
+        return _unpack_hs_blobs(data, len(header))
+    except (struct.error, UnicodeDecodeError, ValueError):
+        return {}
+
+
+def _unpack_hs_blobs(data, pos):
+    """Parse the cache records from data[pos:]; raises ValueError or struct.error if malformed."""
+    blobs = {}
+    while pos < len(data):
+        (key_len,) = _HS_KEY_LEN.unpack_from(data, pos)
+        pos += _HS_KEY_LEN.size
+        if key_len == _HS_NO_KEY:
+            key = None
+        else:
+            if pos + key_len > len(data):
+                raise ValueError("truncated key")
+            key = data[pos:pos + key_len].decode("utf-8")
+            pos += key_len
+        (blob_len,) = _HS_BLOB_LEN.unpack_from(data, pos)
+        pos += _HS_BLOB_LEN.size
+        if pos + blob_len > len(data):
+            raise ValueError("truncated database")
+        blobs[key] = data[pos:pos + blob_len]
+        pos += blob_len
+    return blobs
+
+
+def _pack_hs_blobs(mtime_ns, blobs):
+    parts = [_hs_cache_header(mtime_ns)]
+    for key, blob in blobs.items():
+        if key is None:
+            parts.append(_HS_KEY_LEN.pack(_HS_NO_KEY))
+        else:
+            encoded = key.encode("utf-8")
+            parts += [_HS_KEY_LEN.pack(len(encoded)), encoded]
+        parts += [_HS_BLOB_LEN.pack(len(blob)), blob]
+    return b"".join(parts)
+
+
+def _write_hs_cache(yaml_path, mtime_ns, blobs):
+    """Atomically replace the on-disk cache; silently skipped if the directory is read-only."""
+    cache_path = _hs_cache_path(yaml_path)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(_pack_hs_blobs(mtime_ns, blobs))
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def _load_hyperscan(blob):
+    """Deserialize a cached Hyperscan database, or None if this platform cannot use it."""
+    try:
+        db = hyperscan.loadb(blob, hyperscan.HS_MODE_BLOCK)
+        db.scratch = hyperscan.Scratch(db)
+    except hyperscan.error:
+        return None
+    return db
+
+
+def _strip_global_flags(pattern):
+    """Remove leading global inline flags like (?i) from a pattern string."""
+    while pattern.startswith("(?"):
+        end = pattern.find(")")
+        letters = pattern[2:end]
+        if end < 0 or not letters or not all(c in "aiLmsux" for c in letters):
+            break
+        pattern = pattern[end + 1:]
+    return pattern
+
+
+def _compile_union(pattern_list):
+    """Compile one alternation of every pattern in a category, each with its own flags.
+
+    Returns None if the patterns cannot be combined (e.g. duplicate group names).
+    """
+    parts = []
+    for pat in pattern_list:
+        regex = pat["regex"]
+        letters = "".join(c for c, flag in _SCOPED_FLAGS if regex.flags & flag)
+        parts.append(f"(?{letters}:{_strip_global_flags(regex.pattern)})")
+    try:
+        return re.compile("|".join(parts))
+    except re.error:
+        return None
+
+
+def _line_starts(source):
+    """Return the offset at which each line of source begins."""
+    starts = [0]
+    pos = source.find("\n")
+    while pos != -1:
+        starts.append(pos + 1)
+        pos = source.find("\n", pos + 1)
+    return starts
+
+
+def _compile_hyperscan(pattern_list):
+    """Compile a category into a Hyperscan block-mode database in prefilter mode.
+
+    Prefilter mode accepts constructs Hyperscan cannot match exactly (the
+    negative lookaheads in patterns.yaml) by widening them, so a scan may
+    report a pattern that re then rejects but never misses one. Patterns are
+    matched as UTF-8 with Unicode word classes so word boundaries agree with re.
+
+    Returns None if hyperscan is not installed or a pattern does not compile.
+    """
+    if hyperscan is None:
+        return None
+    base_flags = (hyperscan.HS_FLAG_PREFILTER | hyperscan.HS_FLAG_SINGLEMATCH
+                  | hyperscan.HS_FLAG_ALLOWEMPTY | hyperscan.HS_FLAG_UTF8
+                  | hyperscan.HS_FLAG_UCP)
+    expressions, flags = [], []
+    for pat in pattern_list:
+        regex = pat["regex"]
+        hs_flags = base_flags
+        if regex.flags & re.IGNORECASE:
+            hs_flags |= hyperscan.HS_FLAG_CASELESS
+        if regex.flags & re.DOTALL:
+            hs_flags |= hyperscan.HS_FLAG_DOTALL
+        if regex.flags & re.MULTILINE:
+            hs_flags |= hyperscan.HS_FLAG_MULTILINE
+        expressions.append(_strip_global_flags(regex.pattern).encode("utf-8"))
+        flags.append(hs_flags)
+
+    db = hyperscan.Database(mode=hyperscan.HS_MODE_BLOCK)
+    try:
+        db.compile(expressions=expressions, ids=list(range(len(expressions))),
+                   elements=len(expressions), flags=flags)
+    except hyperscan.error:
+        return None
+    return db
+
+
+def _hyperscan_hits(db, source, data=None):
+    """Return the set of pattern indices that may match source, or None if unscannable.
+
+    data is source encoded as UTF-8, when the caller already has it.
+    """
+    if data is None:
+        try:
+            data = source.encode("utf-8")
+        except UnicodeEncodeError:  # lone surrogates: not valid UTF-8
+            return None
+    hits = set()
+
+    def on_match(pattern_id, start, end, flags, context):
+        hits.add(pattern_id)
+
+    db.scan(data, match_event_handler=on_match)
+    return hits
+
+
+def _candidate_patterns(source, compiled):
+    """Return the patterns of a category that may match source, in patterns.yaml order."""
+    if compiled["hs"] is not None:
+        hits = _hyperscan_hits(compiled["hs"], source)
+        if hits is not None:
+            return [pat for i, pat in enumerate(compiled["patterns"]) if i in hits]
+    if compiled["any"] is not None and compiled["any"].search(source) is None:
+        return []
+    return compiled["patterns"]
+
+
 def _find_matches(source, patterns, category):
     """Apply all patterns in a category to source text, return list of match dicts."""
+    return _match_dicts(source, _candidate_patterns(source, patterns[category]))
+
+
+def _match_dicts(source, candidates, line_starts=None):
+    """Run each candidate pattern over source, return list of match dicts.
+
+    line_starts (from _line_starts) can be passed in when the caller has it.
+    """
+    matches = [(pat, m) for pat in candidates for m in pat["regex"].finditer(source)]
+    if not matches:
+        return []
+
+    if line_starts is None:
+        line_starts = _line_starts(source)
+    if len(matches) >= _VECTORIZE_MIN_MATCHES:
+        import numpy as np  # deferred: only files with very many matches need it
+
+        starts = np.fromiter((m.start() for _, m in matches), dtype=np.int64, count=len(matches))
+        lines = np.searchsorted(np.array(line_starts, dtype=np.int64), starts, side="right").tolist()
+    else:
+        lines = [bisect_right(line_starts, m.start()) for _, m in matches]
+
     results = []
-    for pat in patterns[category]:
-        for m in pat["regex"].finditer(source):
-            line_num = source[:m.start()].count("\n") + 1
-            match_dict = {"pattern_name": pat["name"], "line": line_num}
-            for group_idx, semantic_name in pat["groups"].items():
-                match_dict[semantic_name] = m.group(group_idx)
-            results.append(match_dict)
+    for (pat, m), line_num in zip(matches, lines):
+        match_dict = {"pattern_name": pat["name"], "line": line_num}
+        for group_idx, semantic_name in pat["groups"].items():
+            match_dict[semantic_name] = m.group(group_idx)
+        results.append(match_dict)
     return results
 
 
+def parse_all(source, patterns, categories=None, data=None):
+    """Apply every category (or only those in categories) to source.
+
+    Returns dict: category → list of match dicts, the same lists the
+    parse_* functions return. With the all-category Hyperscan database the
+    source is scanned once to pick the candidate patterns of every
+    category; otherwise each category is prefiltered on its own. Line
+    offsets are computed once for all categories. Pass data, the UTF-8
+    bytes source was decoded from, to spare Hyperscan re-encoding it.
+    """
+    if categories is None:
+        categories = list(patterns)
+    candidates = _candidates_by_category(source, patterns, categories, data)
+
+    line_starts = None
+    results = {}
+    for category in categories:
+        if candidates[category] and line_starts is None:
+            line_starts = _line_starts(source)
+        results[category] = _match_dicts(source, candidates[category], line_starts)
+    if "let_statement" in results:
+        _strip_let_values(results["let_statement"])
+    return results
+
+
+def _candidates_by_category(source, patterns, categories, data=None):
+    """Return {category: candidate patterns} for categories, in patterns.yaml order."""
+    hs_db = getattr(patterns, "hs", None)
+    hits = _hyperscan_hits(hs_db, source, data) if hs_db is not None else None
+    if hits is None:
+        return {category: _candidate_patterns(source, patterns[category])
+                for category in categories}
+
+    candidates = {category: [] for category in categories}
+    for pattern_id in sorted(hits):
+        category, i = patterns.hs_index[pattern_id]
+        if category in candidates:
+            candidates[category].append(patterns[category]["patterns"][i])
+    return candidates
+
+
 def parse_table_writes(source, patterns):
     """Extract table write operations from SAS source."""
     return _find_matches(source, patterns, "table_write")
@@ -77,7 +431,10 @@ def parse_libnames(source, patterns):
 
 def parse_let_statements(source, patterns):
     """Extract %LET variable assignments from SAS source."""
-    results = _find_matches(source, patterns, "let_statement")
+    return _strip_let_values(_find_matches(source, patterns, "let_statement"))
+
+
+def _strip_let_values(results):
     for r in results:
         if "value" in r:
             r["value"] = r["value"].strip()
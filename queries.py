@@ -1,104 +1,131 @@
-"""Impact analysis queries — recursive CTEs against SQLite."""
+"""Impact analysis queries — graph traversal over the scanned SQLite data."""
 
-import pandas as pd
+from collections import deque
 
 
-def downstream_impact(conn, program_path):
-    """Find all programs and tables downstream of a given program.
+# Maximum traversal depth (guards against runaway dependency chains)
+MAX_DEPTH = 20
+
+_IMPACT_COLUMNS = ["program_path", "depth"]
+
+
+def build_adjacency(conn):
+    """Load the program graph into memory as adjacency sets.
+
+    Returns (downstream, upstream): dicts of program_path → set of program_paths.
+    downstream[p] holds the programs directly impacted by a change to p
+    (readers of tables p writes, and programs that include/call p);
+    upstream is the same graph reversed. Edges come from program_edges,
+    which the scanner rebuilds after each scan (db.rebuild_program_edges).
+
+    Build once and pass to downstream_impact / upstream_dependencies when
+    running many queries against the same database.
+    """
+    # Edges are stored as interned path ids; map each id to one shared str
+    paths = dict(conn.execute("SELECT id, path FROM paths"))
+    downstream = {}
+    upstream = {}
+    for source_id, target_id in conn.execute(
+        "SELECT DISTINCT source_id, target_id FROM program_edges"
+    ):
+        source, target = paths[source_id], paths[target_id]
+        downstream.setdefault(source, set()).add(target)
+        upstream.setdefault(target, set()).add(source)
+    return downstream, upstream
+
+
+def _result(columns, rows, as_dataframe):
+    """Return rows as a DataFrame, or as (columns, rows) when as_dataframe is False."""
+    if as_dataframe:
+        import pandas as pd  # deferred: the CLI asks for plain rows
+
+        return pd.DataFrame(rows, columns=columns)
+    return columns, rows
+
+
+def _query(conn, sql, params=(), as_dataframe=True):
+    cursor = conn.execute(sql, params)
+    columns = [d[0] for d in cursor.description]
+    return _result(columns, cursor.fetchall(), as_dataframe)
+
+
+def _traverse(adjacency, program_path, max_depth):
+    """Breadth-first walk from program_path; returns [(program_path, depth)] sorted by depth."""
+    depths = {program_path: 0}
+    queue = deque([program_path])
+    while queue:
+        current = queue.popleft()
+        depth = depths[current]
+        if depth >= max_depth:
+            continue
+        for neighbor in adjacency.get(current, ()):
+            if neighbor not in depths:
+                depths[neighbor] = depth + 1
+                queue.append(neighbor)
+
+    del depths[program_path]
+    return sorted(depths.items(), key=lambda item: (item[1], item[0]))
+
+
+def downstream_impact(conn, program_path, adjacency=None, max_depth=MAX_DEPTH,
+                      as_dataframe=True):
+    """Find all programs downstream of a given program.
 
     Logic: find tables this program writes → programs that read those tables →
     tables those programs write → etc. Also follows program dependencies.
+    Each program is reported once, at its shortest distance.
+    Returns a DataFrame (program_path, depth), or (columns, rows) when
+    as_dataframe is False.
     """
-    sql = """
-    WITH RECURSIVE
-    -- Seed: the starting program
-    impacted_programs(program_path, depth) AS (
-        SELECT ?, 0
-
-        UNION
-
-        -- Programs that read tables written by an impacted program
-        SELECT DISTINCT r.program_path, ip.depth + 1
-        FROM impacted_programs ip
-        JOIN table_operations w ON w.program_path = ip.program_path AND w.operation_type = 'create'
-        JOIN table_operations r ON r.table_name = w.table_name AND r.operation_type = 'read'
-        WHERE r.program_path != ip.program_path
-          AND ip.depth < 20
-
-        UNION
-
-        -- Programs that depend on (include/call) an impacted program
-        SELECT DISTINCT pd.source_program, ip.depth + 1
-        FROM impacted_programs ip
-        JOIN program_dependencies pd ON pd.target_program = ip.program_path
-        WHERE pd.source_program != ip.program_path
-          AND ip.depth < 20
-    )
-    SELECT DISTINCT program_path, MIN(depth) as depth
-    FROM impacted_programs
-    WHERE program_path != ?
-    GROUP BY program_path
-    ORDER BY depth, program_path
-    """
-    return pd.read_sql_query(sql, conn, params=(program_path, program_path))
+    if adjacency is None:
+        adjacency = build_adjacency(conn)
+    return _result(_IMPACT_COLUMNS, _traverse(adjacency[0], program_path, max_depth), as_dataframe)
 
 
-def upstream_dependencies(conn, program_path):
-    """Find all programs and tables upstream of a given program.
+def upstream_dependencies(conn, program_path, adjacency=None, max_depth=MAX_DEPTH,
+                          as_dataframe=True):
+    """Find all programs upstream of a given program.
 
     Reverse direction: find tables this program reads → programs that write those →
     tables those read → etc. Also follows program dependencies.
+    Returns the same shapes as downstream_impact.
     """
-    sql = """
-    WITH RECURSIVE
-    upstream(program_path, depth) AS (
-        SELECT ?, 0
-
-        UNION
-
-        -- Programs that write tables read by an upstream program
-        SELECT DISTINCT w.program_path, u.depth + 1
-        FROM upstream u
-        JOIN table_operations r ON r.program_path = u.program_path AND r.operation_type = 'read'
-        JOIN table_operations w ON w.table_name = r.table_name AND w.operation_type = 'create'
-        WHERE w.program_path != u.program_path
-          AND u.depth < 20
-
-        UNION
-
-        -- Programs that this program includes/calls
-        SELECT DISTINCT pd.target_program, u.depth + 1
-        FROM upstream u
-        JOIN program_dependencies pd ON pd.source_program = u.program_path
-        WHERE pd.target_program != u.program_path
-          AND u.depth < 20
-    )
-    SELECT DISTINCT program_path, MIN(depth) as depth
-    FROM upstream
-    WHERE program_path != ?
-    GROUP BY program_path
-    ORDER BY depth, program_path
-    """
-    return pd.read_sql_query(sql, conn, params=(program_path, program_path))
+    if adjacency is None:
+        adjacency = build_adjacency(conn)
+    return _result(_IMPACT_COLUMNS, _traverse(adjacency[1], program_path, max_depth), as_dataframe)
+
 
+def table_impact(conn, table_name, as_dataframe=True):
+    """Find all programs that read or write a given table.
 
-def table_impact(conn, table_name):
-    """Find all programs that read or write a given table."""
+    Returns a DataFrame, or (columns, rows) when as_dataframe is False.
+    """
     sql = """
     SELECT program_path, operation_type, database_type, source_line
     FROM table_operations
     WHERE table_name = ?
     ORDER BY operation_type, program_path
     """
-    return pd.read_sql_query(sql, conn, params=(table_name,))
+    return _query(conn, sql, (table_name,), as_dataframe)
 
 
-def credential_report(conn):
-    """Return all programs that have credential findings."""
-    sql = """
+# '[]' and '' both mean "scanned, nothing found"
+_CREDENTIAL_SQL = """
     SELECT program_path, credential_findings
     FROM programs
-    WHERE credential_findings IS NOT NULL AND credential_findings != '[]'
+    WHERE credential_findings IS NOT NULL AND credential_findings NOT IN ('', '[]')
     ORDER BY program_path
+"""
+
+
+def credential_report(conn, as_dataframe=True):
+    """Return all programs that have credential findings.
+
+    Returns a DataFrame, or (columns, rows) when as_dataframe is False.
     """
-    return pd.read_sql_query(sql, conn)
+    return _query(conn, _CREDENTIAL_SQL, as_dataframe=as_dataframe)
+
+
+def iter_credential_findings(conn):
+    """Yield (program_path, credential_findings) for each flagged program, streamed from the cursor."""
+    yield from conn.execute(_CREDENTIAL_SQL)
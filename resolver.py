@@ -1,10 +1,12 @@
 """Resolve macro variables, table names, LIBNAME mappings, and Snowflake scoping."""
 
 import re
+from functools import lru_cache
 
 
 # Snowflake databases where writes are in scope
 SNOWFLAKE_WRITE_SCOPE_DBS = {"LIS_DTALAB_WRKGRP_SPC_DB", "DATALAB_ILSNP"}
+_SNOWFLAKE_WRITE_SCOPE_DBS_UPPER = frozenset(s.upper() for s in SNOWFLAKE_WRITE_SCOPE_DBS)
 
 # Default datalab_connections macro variable values
 DATALAB_DEFAULTS = {
@@ -14,6 +16,11 @@ DATALAB_DEFAULTS = {
     "sf_schema": "DL_T1_ILS_ANALYTICS",
 }
 
+# &varname or &varname. (trailing dot is the SAS macro var delimiter)
+_MACRO_VAR_RE = re.compile(r'&(\w+)\.?', re.IGNORECASE)
+
+_DATALAB_CONNECTIONS_RE = re.compile(r'%datalab_connections\b', re.IGNORECASE)
+
 
 def resolve_macro_vars(let_statements):
     """Build macro variable map from parsed %LET statements.
@@ -36,7 +43,7 @@ def apply_datalab_connections(source, macro_vars, datalab_defaults=None):
     """
     if datalab_defaults is None:
         datalab_defaults = DATALAB_DEFAULTS
-    if re.search(r'(?i)%datalab_connections\b', source):
+    if _DATALAB_CONNECTIONS_RE.search(source):
         for var, val in datalab_defaults.items():
             if var.lower() not in macro_vars:
                 macro_vars[var.lower()] = val
@@ -44,14 +51,23 @@ def apply_datalab_connections(source, macro_vars, datalab_defaults=None):
 
 
 def _substitute_macro_vars(text, macro_vars):
-    """Replace &variable references with resolved values."""
+    """Replace &variable references with resolved values.
+
+    macro_vars must have lowercased keys, as built by resolve_macro_vars.
+    """
+    if "&" not in text:
+        return text
+    lookup = macro_vars.get
+
     def replacer(m):
-        var_name = m.group(1).lower()
-        # Handle trailing dot (SAS macro var delimiter)
-        return macro_vars.get(var_name, m.group(0))
+        return lookup(m.group(1).lower(), m.group(0))
+
+    return _MACRO_VAR_RE.sub(replacer, text)
 
-    # Match &varname or &varname.
-    return re.sub(r'&(\w+)\.?', replacer, text, flags=re.IGNORECASE)
+
+def normalize_known_librefs(known_librefs):
+    """Return a copy of a libref → engine dict (e.g. from config) with lowercased keys."""
+    return {libref.lower(): engine for libref, engine in (known_librefs or {}).items()}
 
 
 def resolve_table_name(raw_libref, raw_table, macro_vars, libname_map, known_librefs):
@@ -62,6 +78,9 @@ def resolve_table_name(raw_libref, raw_table, macro_vars, libname_map, known_lib
     2. Look up libref in libname_map (parsed LIBNAME statements)
     3. Fall back to known_librefs (from config)
     4. If still unresolved, return ("unknown.<table>", "unknown")
+
+    libname_map and known_librefs must have lowercased keys: build_libname_map
+    does this, and normalize_known_librefs does it for config maps.
     """
     if raw_libref is None:
         raw_libref = "unknown"
@@ -70,14 +89,21 @@ def resolve_table_name(raw_libref, raw_table, macro_vars, libname_map, known_lib
 
     libref = _substitute_macro_vars(raw_libref, macro_vars).lower()
     table = _substitute_macro_vars(raw_table, macro_vars).lower()
+    return resolve_table_name_fast(libref, table, macro_vars, libname_map, known_librefs)
+
 
+def resolve_table_name_fast(libref, table, macro_vars, libname_map, known_librefs):
+    """resolve_table_name for a libref and table already substituted and lowercased.
+
+    Does no normalization: all maps must have lowercased keys.
+    """
     # Check if libref still has unresolved macro var
     if "&" in libref:
         return f"unknown.{table}", "unknown"
 
     # Look up in parsed LIBNAME map first
-    if libref in libname_map:
-        mapping = libname_map[libref]
+    mapping = libname_map.get(libref)
+    if mapping is not None:
         engine = mapping["engine"]
         if engine == "oracle":
             schema = mapping.get("schema", libref)
@@ -91,8 +117,7 @@ def resolve_table_name(raw_libref, raw_table, macro_vars, libname_map, known_lib
 
     # Fall back to known librefs from config
     if libref in known_librefs:
-        engine = known_librefs[libref]
-        return f"{libref}.{table}", engine
+        return f"{libref}.{table}", known_librefs[libref]
 
     # Work library — local
     if libref == "work":
@@ -105,31 +130,55 @@ def detect_snowflake_write_scope(qualified_name, db_type, scope_dbs=None):
     """Check if a Snowflake write targets an in-scope database.
 
     Only writes to LIS_DTALAB_WRKGRP_SPC_DB or DATALAB_ILSNP are in scope.
+    Pass a custom scope_dbs as a frozenset to avoid converting it per call.
     """
-    if scope_dbs is None:
-        scope_dbs = SNOWFLAKE_WRITE_SCOPE_DBS
     if db_type != "snowflake":
         return False
-    parts = qualified_name.split(".")
-    if len(parts) >= 1:
-        db_name = parts[0].upper()
-        return db_name in {s.upper() for s in scope_dbs}
-    return False
+    if scope_dbs is None:
+        scope_upper = _SNOWFLAKE_WRITE_SCOPE_DBS_UPPER
+    else:
+        if not isinstance(scope_dbs, frozenset):
+            scope_dbs = frozenset(scope_dbs)
+        scope_upper = _upper_scope_dbs(scope_dbs)
+    db_name = qualified_name.split(".", 1)[0].upper()
+    return db_name in scope_upper
+
+
+@lru_cache(maxsize=32)
+def _upper_scope_dbs(scope_dbs):
+    """Upper-cased copy of a frozenset of scope database names."""
+    return frozenset(s.upper() for s in scope_dbs)
+
+
+@lru_cache(maxsize=None)
+def libname_engine(pattern_name):
+    """Return the engine a LIBNAME pattern name denotes: oracle, snowflake, base or unknown.
+
+    Pattern names are a handful of fixed strings, so the substring checks
+    run once per name.
+    """
+    if "oracle" in pattern_name:
+        return "oracle"
+    if "snowflake" in pattern_name:
+        return "snowflake"
+    if "base" in pattern_name:
+        return "base"
+    return "unknown"
 
 
 def build_libname_map(parsed_libnames, macro_vars):
     """Build a libref → {engine, schema/database/path} map from parsed LIBNAME results."""
     libname_map = {}
     for entry in parsed_libnames:
-        name = entry.get("pattern_name", "")
+        engine = libname_engine(entry.get("pattern_name", ""))
         libref = entry.get("libref", "").lower()
-        if "oracle" in name:
+        if engine == "oracle":
             libname_map[libref] = {
                 "engine": "oracle",
                 "path": entry.get("path", ""),
                 "schema": entry.get("schema", ""),
             }
-        elif "snowflake" in name:
+        elif engine == "snowflake":
             db = entry.get("database", "")
             schema = entry.get("schema", "")
             # Resolve macro vars in database/schema
@@ -140,7 +189,7 @@ def build_libname_map(parsed_libnames, macro_vars):
                 "database": db,
                 "schema": schema,
             }
-        elif "base" in name:
+        elif engine == "base":
             libname_map[libref] = {
                 "engine": "base",
                 "path": entry.get("path", ""),
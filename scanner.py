@@ -1,68 +1,106 @@
 """Pipeline orchestrator — connects all modules into the scan pipeline."""
 
+import hashlib
 import json
 import logging
 import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
+from typing import NamedTuple
 
-import pandas as pd
 import yaml
 
-from parser import (
-    load_patterns,
-    parse_table_writes,
-    parse_table_reads,
-    parse_includes,
-    parse_macro_defs,
-    parse_macro_calls,
-    parse_libnames,
-    parse_let_statements,
-    parse_credentials,
-)
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader
+
+from parser import load_patterns, parse_all
 from resolver import (
     resolve_macro_vars,
     apply_datalab_connections,
     resolve_table_name,
     detect_snowflake_write_scope,
     build_libname_map,
+    libname_engine,
+    normalize_known_librefs,
 )
 from db import (
     init_db,
+    begin,
+    close_db,
+    optimize_db,
     get_scan_state,
+    get_content_state,
+    touch_programs,
+    get_macro_definitions,
+    upsert_macro_definitions,
     upsert_programs,
-    upsert_table_operations,
-    upsert_program_dependencies,
+    upsert_table_operations_bulk,
+    upsert_program_dependencies_bulk,
     upsert_libname_mappings,
-    clear_program,
+    clear_programs,
+    rebuild_program_edges,
+)
+from sftp_client import (
+    connect,
+    open_client,
+    walk_remote,
+    iter_remote,
+    read_file_bytes,
+    decode_source,
+    close,
 )
-from sftp_client import connect, walk_remote, read_file, close
 
 log = logging.getLogger(__name__)
 
+# Files whose table operations / dependencies are written per transaction
+BATCH_SIZE = 500
+
+# Default number of threads fetching files over SFTP, each on its own
+# channel. OpenSSH allows 10 sessions per connection (MaxSessions) by default.
+FETCH_WORKERS = 8
+
+# Pattern categories parse_one applies; macro definitions only matter in macro_dirs
+_PROGRAM_CATEGORIES = (
+    "let_statement", "libname", "table_write", "table_read", "credentials",
+    "include", "macro_call",
+)
+_MACRO_FILE_CATEGORIES = _PROGRAM_CATEGORIES + ("macro_def",)
+
 
 def load_config(config_path=None):
     """Load config.yaml and return dict."""
     if config_path is None:
         config_path = Path(__file__).parent / "config.yaml"
     with open(config_path) as f:
-        return yaml.safe_load(f)
+        return yaml.load(f, Loader=SafeLoader)
 
 
-def scan(config_path=None, full=False):
+def scan(config_path=None, full=False, workers=1, fetch_workers=FETCH_WORKERS):
     """Run the full scan pipeline.
 
     1. Load config, compile patterns, init DB
     2. Connect SFTP
-    3. Walk macro dir first → build macro catalog
+    3. Walk macro dir first → build macro catalog (stored catalog for unchanged files)
     4. Walk all scan roots → parse each .sas file
     5. Write results to SQLite
     6. Clear removed files
-    7. Print summary
+    7. Rebuild derived program_edges
+    8. Print summary
+
+    workers > 1 parses files in that many worker processes (0 means one per
+    CPU). fetch_workers threads list directories and read files over SFTP
+    concurrently (1 does it one request at a time on the main connection).
+    All database writes stay on this thread.
     """
     config = load_config(config_path)
     project_root = Path(__file__).parent
-    patterns = load_patterns(project_root / "patterns.yaml")
+    patterns_path = project_root / "patterns.yaml"
+    patterns = load_patterns(patterns_path)
 
     db_path = config.get("database", "sas_mapper.db")
     if not os.path.isabs(db_path):
@@ -70,96 +108,177 @@ def scan(config_path=None, full=False):
     conn = init_db(db_path)
 
     scan_state = {} if full else get_scan_state(conn)
-    known_librefs = config.get("known_librefs", {}) or {}
+    content_state = {} if full else get_content_state(conn)
+    known_librefs = normalize_known_librefs(config.get("known_librefs"))
     datalab_defaults = config.get("datalab_defaults", {})
-    scope_dbs = set(config.get("snowflake_write_scope", []))
+    scope_dbs = frozenset(config.get("snowflake_write_scope", []))
     extensions = set(config.get("extensions", [".sas"]))
+    parse_config = (known_librefs, datalab_defaults, scope_dbs)
 
     sftp = connect()
+    fetcher = _Fetcher(sftp, fetch_workers)
     now = datetime.now(timezone.utc).isoformat()
 
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(str(patterns_path), parse_config),
+        )
+
     # Track all files seen on SFTP for cleanup
     all_remote_paths = set()
     macro_catalog = {}  # macro_name (lower) → file_path
 
     stats = {"scanned": 0, "skipped": 0, "errors": 0, "removed": 0}
 
+    # (program_path, rows) pairs waiting for the next batched write
+    pending_ops = []
+    pending_deps = []
+    # touch_programs rows for files whose mtime moved but content did not
+    pending_touches = []
+    # program_path → content hash of the source read this run, until stored
+    content_hashes = {}
+
+    def pending_entries(entries, macro_dir_files):
+        """Yield the entries that need to be read and parsed."""
+        for entry in entries:
+            path = entry["path"]
+
+            if not macro_dir_files:
+                # Skip if already processed as macro file
+                if path in all_remote_paths:
+                    continue
+            all_remote_paths.add(path)
+
+            # scan_state is empty on a full scan. A file keeping its mtime
+            # but not its stored size has still changed, so it is read.
+            prev_mtime = scan_state.get(path)
+            prev_content = content_state.get(path)
+            st = entry["stat"]
+            unchanged = (
+                prev_mtime is not None and prev_mtime == st.st_mtime
+                and (prev_content is None or prev_content[0] == st.st_size)
+            )
+            # A macro file's definitions are stored with its content hash, so
+            # one without a hash (last scanned before the catalog was kept)
+            # is reparsed to record them
+            if unchanged and not (macro_dir_files and prev_content is None):
+                continue
+
+            yield entry
+
+    def read_entries(entries, macro_dir_files):
+        """Yield (entry, source) for each file that needs parsing, in walk order.
+
+        A file whose mtime changed but whose size and content hash match the
+        stored ones (e.g. touched by rsync) only has its times updated.
+        """
+        for entry, source in fetcher.fetch(
+            pending_entries(entries, macro_dir_files)
+        ):
+            if source is None:
+                stats["errors"] += 1
+                continue
+            path = entry["path"]
+            st = entry["stat"]
+            digest = _content_hash(source)
+            if content_state.get(path) == (st.st_size, digest):
+                pending_touches.append((st.st_mtime, st.st_atime, now, path))
+                continue
+            content_hashes[path] = digest
+            yield entry, source
+
+    def store_all(parsed_entries, macro_dir_files=False):
+        for entry, parsed in parsed_entries:
+            path = entry["path"]
+            # One write transaction per batch; _flush commits it
+            begin(conn)
+            if pending_touches:
+                touch_programs(conn, pending_touches)
+                pending_touches.clear()
+            if macro_dir_files:
+                upsert_macro_definitions(conn, path, parsed.macro_defs)
+
+            ops, deps = _store_parsed(conn, path, entry["stat"], parsed, macro_catalog, now,
+                                      content_hashes.pop(path, None))
+            pending_ops.append((path, ops))
+            pending_deps.append((path, deps))
+            stats["scanned"] += 1
+            if len(pending_ops) >= BATCH_SIZE:
+                _flush(conn, pending_ops, pending_deps)
+        begin(conn)
+        if pending_touches:
+            touch_programs(conn, pending_touches)
+            pending_touches.clear()
+        _flush(conn, pending_ops, pending_deps)
+        optimize_db(conn)
+
     try:
         # --- Phase 1: Scan macro directory ---
         macro_dir = config.get("macro_directory")
         if macro_dir:
             log.info("Scanning macro directory: %s", macro_dir)
-            macro_files = walk_remote(sftp, macro_dir, extensions)
+            macro_files = walk_remote(sftp, macro_dir, extensions, workers=fetch_workers)
+            stored_defs = {} if full else get_macro_definitions(conn)
+            # Unchanged macro files with recorded definitions are skipped
+            parsed_macros = list(_parse_in_order(
+                pool, read_entries(macro_files, True),
+                patterns, parse_config, True, workers * 4,
+            ))
+            # Catalog in walk order, later definitions winning: freshly
+            # parsed names for files read this run, stored ones otherwise
+            fresh_defs = {entry["path"]: parsed.macro_defs for entry, parsed in parsed_macros}
             for entry in macro_files:
                 path = entry["path"]
-                all_remote_paths.add(path)
-                mtime = entry["stat"].st_mtime
-
-                if not full and path in scan_state and scan_state[path] == mtime:
-                    stats["skipped"] += 1
-                    # Still need macro catalog from previously parsed macros
-                    # We'll rebuild from DB or re-parse — for simplicity, always parse macro dir
-                    pass
-
-                try:
-                    source = read_file(sftp, path)
-                except Exception as e:
-                    log.error("Failed to read %s: %s", path, e)
-                    stats["errors"] += 1
-                    continue
-
-                # Parse macro definitions for catalog
-                macro_defs = parse_macro_defs(source, patterns)
-                for md in macro_defs:
-                    macro_catalog[md["name"].lower()] = path
-
-                # Also parse the macro file for everything else
-                _process_file(
-                    conn, sftp, path, entry["stat"], source, patterns,
-                    macro_catalog, known_librefs, datalab_defaults, scope_dbs, now,
-                )
-                stats["scanned"] += 1
+                for name in fresh_defs.get(path, stored_defs.get(path, ())):
+                    macro_catalog[name] = path
+            store_all(parsed_macros, macro_dir_files=True)
 
         # --- Phase 2: Scan all roots ---
         for root in config.get("scan_roots", []):
             log.info("Scanning root: %s", root)
-            files = walk_remote(sftp, root, extensions)
-            for entry in files:
-                path = entry["path"]
-
-                # Skip if already processed as macro file
-                if path in all_remote_paths:
-                    continue
-                all_remote_paths.add(path)
-
-                mtime = entry["stat"].st_mtime
-                if not full and path in scan_state and scan_state[path] == mtime:
-                    stats["skipped"] += 1
-                    continue
+            # Streamed, so files are read and parsed while the tree is still
+            # being listed. The listing stays on the main channel: the fetch
+            # threads already hold the rest of the MaxSessions budget.
+            files = iter_remote(sftp, root, extensions)
+            store_all(_parse_in_order(
+                pool, read_entries(files, False), patterns, parse_config, False, workers * 4,
+            ))
+
+        # Every file walked was stored, failed to read, or left unchanged
+        # (skipped unread, or only touched)
+        stats["skipped"] = len(all_remote_paths) - stats["scanned"] - stats["errors"]
+
+        # Phases 3 and 4 commit together, so readers never see edges
+        # pointing at removed programs
+        begin(conn)
+        with conn:
+            # --- Phase 3: Clean removed files ---
+            removed = [path for path in scan_state if path not in all_remote_paths]
+            clear_programs(conn, removed)
+            stats["removed"] = len(removed)
+            for old_path in removed:
+                log.info("Removed deleted file: %s", old_path)
 
-                try:
-                    source = read_file(sftp, path)
-                except Exception as e:
-                    log.error("Failed to read %s: %s", path, e)
-                    stats["errors"] += 1
-                    continue
+            # --- Phase 4: Derive program → program impact edges ---
+            rebuild_program_edges(conn)
 
-                _process_file(
-                    conn, sftp, path, entry["stat"], source, patterns,
-                    macro_catalog, known_librefs, datalab_defaults, scope_dbs, now,
-                )
-                stats["scanned"] += 1
-
-        # --- Phase 3: Clean removed files ---
-        for old_path in scan_state:
-            if old_path not in all_remote_paths:
-                clear_program(conn, old_path)
-                stats["removed"] += 1
-                log.info("Removed deleted file: %s", old_path)
+    except BaseException:
+        # Drop the unfinished batch; earlier batches are already committed
+        if conn.in_transaction:
+            conn.rollback()
+        raise
 
     finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        fetcher.close()
         close(sftp)
-        conn.close()
+        close_db(conn)
 
     log.info(
         "Scan complete: %d scanned, %d skipped, %d errors, %d removed",
@@ -168,136 +287,261 @@ def scan(config_path=None, full=False):
     return stats
 
 
-def _process_file(conn, sftp, path, stat_attrs, source, patterns,
-                   macro_catalog, known_librefs, datalab_defaults, scope_dbs, now):
-    """Parse and store results for a single SAS file."""
+def _flush(conn, pending_ops, pending_deps):
+    """Write the pending table operations and dependencies, then clear them."""
+    upsert_table_operations_bulk(conn, pending_ops)
+    upsert_program_dependencies_bulk(conn, pending_deps)
+    pending_ops.clear()
+    pending_deps.clear()
+
+
+# --- Fetching (SFTP reads, in threads) ---
+
+class _Fetcher:
+    """Read remote files on a pool of threads, one SFTP channel per thread."""
+
+    def __init__(self, sftp, workers):
+        self.sftp = sftp
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        self._local = threading.local()
+        self._clients = []
+        self._lock = threading.Lock()
+
+    def fetch(self, entries):
+        """Yield (entry, source) in input order; source is None if the read failed.
+
+        At most workers * 4 reads are in flight, so a slow server is not
+        flooded and fetched sources do not pile up ahead of parsing.
+        """
+        if self._executor is None:
+            for entry in entries:
+                yield entry, _read_logged(self.sftp, entry)
+            return
+
+        window = deque()
+        for entry in entries:
+            window.append((entry, self._executor.submit(self._read, entry)))
+            if len(window) >= self.workers * 4:
+                done_entry, future = window.popleft()
+                yield done_entry, future.result()
+        while window:
+            done_entry, future = window.popleft()
+            yield done_entry, future.result()
+
+    def _read(self, entry):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = open_client(self.sftp)
+            self._local.client = client
+            with self._lock:
+                self._clients.append(client)
+        return _read_logged(client, entry)
+
+    def close(self):
+        """Stop the threads and close their SFTP channels."""
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+        for client in self._clients:
+            client.close()
+        self._clients.clear()
+
+
+def _read_logged(sftp, entry):
+    path = entry["path"]
     try:
-        # Parse %LET statements → resolve macro vars
-        let_stmts = parse_let_statements(source, patterns)
-        macro_vars = resolve_macro_vars(let_stmts)
-
-        # Check for %datalab_connections → apply SF defaults
-        macro_vars = apply_datalab_connections(source, macro_vars, datalab_defaults)
-
-        # Parse LIBNAME statements → build libname map
-        parsed_libnames = parse_libnames(source, patterns)
-        libname_map = build_libname_map(parsed_libnames, macro_vars)
-
-        # Store libname mappings
-        if parsed_libnames:
-            lib_records = []
-            for entry in parsed_libnames:
-                pname = entry.get("pattern_name", "")
-                engine = "unknown"
-                if "oracle" in pname:
-                    engine = "oracle"
-                elif "snowflake" in pname:
-                    engine = "snowflake"
-                elif "base" in pname:
-                    engine = "base"
-                lib_records.append({
-                    "libref": entry.get("libref", "").lower(),
-                    "engine": engine,
-                    "source": "parsed",
-                })
-            if lib_records:
-                upsert_libname_mappings(conn, pd.DataFrame(lib_records))
-
-        # Parse table writes
-        writes = parse_table_writes(source, patterns)
-        write_records = []
-        for w in writes:
-            libref = w.get("libref") or w.get("schema")
-            table = w.get("table")
-            qualified, db_type = resolve_table_name(
-                libref, table, macro_vars, libname_map, known_librefs
-            )
-            in_scope = 1
-            if db_type == "snowflake":
-                in_scope = 1 if detect_snowflake_write_scope(qualified, db_type, scope_dbs) else 0
-            write_records.append({
-                "program_path": path,
-                "table_name": qualified,
-                "database_type": db_type,
-                "operation_type": "create",
-                "source_line": w["line"],
-                "in_scope": in_scope,
-            })
-
-        # Parse table reads
-        reads = parse_table_reads(source, patterns)
-        read_records = []
-        for r in reads:
-            libref = r.get("libref") or r.get("schema")
-            table = r.get("table")
-            qualified, db_type = resolve_table_name(
-                libref, table, macro_vars, libname_map, known_librefs
-            )
-            read_records.append({
-                "program_path": path,
-                "table_name": qualified,
-                "database_type": db_type,
-                "operation_type": "read",
-                "source_line": r["line"],
-                "in_scope": 1,
-            })
-
-        # Parse credentials
-        cred_findings = parse_credentials(source, patterns)
-        cred_json = None
-        if cred_findings:
-            cred_json = json.dumps(
-                [f"[{c['line']}] {c['pattern_name']}: {c['value']}" for c in cred_findings]
+        return read_file_bytes(sftp, path)
+    except Exception as e:
+        log.error("Failed to read %s: %s", path, e)
+        return None
+
+
+# --- Parsing (no database or SFTP access; runs in worker processes) ---
+
+# Per-process (patterns, parse_config) set by _init_worker
+_worker_state = None
+
+
+def _init_worker(patterns_path, parse_config):
+    """Process pool initializer: compile patterns once per worker."""
+    global _worker_state
+    _worker_state = (load_patterns(patterns_path), parse_config)
+
+
+def _parse_in_worker(path, source, want_macro_defs):
+    patterns, parse_config = _worker_state
+    return parse_one(path, source, patterns, *parse_config, want_macro_defs=want_macro_defs)
+
+
+def _parse_in_order(pool, entries, patterns, parse_config, want_macro_defs, max_in_flight=0):
+    """Yield (entry, parsed) for each (entry, source), in input order.
+
+    Without a pool, parses inline. With one, keeps a bounded window of
+    files in flight so reading, parsing and storing overlap.
+    """
+    if pool is None:
+        for entry, source in entries:
+            yield entry, _parse_logged(
+                entry["path"], parse_one, entry["path"], source, patterns, *parse_config,
+                want_macro_defs=want_macro_defs,
             )
+        return
+
+    window = deque()
+    for entry, source in entries:
+        window.append((entry, pool.submit(_parse_in_worker, entry["path"], source, want_macro_defs)))
+        if len(window) >= max_in_flight:
+            done_entry, future = window.popleft()
+            yield done_entry, _parse_logged(done_entry["path"], future.result)
+    while window:
+        done_entry, future = window.popleft()
+        yield done_entry, _parse_logged(done_entry["path"], future.result)
 
-        # Store program record (parent row must exist before child rows)
-        prog_df = pd.DataFrame([{
-            "program_path": path,
-            "file_size": stat_attrs.st_size,
-            "file_mtime": stat_attrs.st_mtime,
-            "file_atime": stat_attrs.st_atime,
-            "file_uid": stat_attrs.st_uid,
-            "file_gid": stat_attrs.st_gid,
-            "file_mode": stat_attrs.st_mode,
-            "owner": str(stat_attrs.st_uid),
-            "scan_timestamp": now,
-            "credential_findings": cred_json,
-        }])
-        upsert_programs(conn, prog_df)
-
-        # Combine and store table operations
-        all_ops = write_records + read_records
-        ops_df = pd.DataFrame(all_ops) if all_ops else pd.DataFrame()
-        upsert_table_operations(conn, path, ops_df)
-
-        # Parse program dependencies
-        dep_records = []
-
-        # %INCLUDE
-        includes = parse_includes(source, patterns)
-        for inc in includes:
-            dep_records.append({
-                "source_program": path,
-                "target_program": inc["path"],
-                "dependency_type": "include",
-            })
-
-        # Macro calls → resolve against catalog
-        calls = parse_macro_calls(source, patterns)
-        for call in calls:
-            macro_name = call["name"].lower()
-            if macro_name in macro_catalog:
-                dep_records.append({
-                    "source_program": path,
-                    "target_program": macro_catalog[macro_name],
-                    "dependency_type": "macro_call",
-                })
-
-        deps_df = pd.DataFrame(dep_records) if dep_records else pd.DataFrame()
-        upsert_program_dependencies(conn, path, deps_df)
-
-        conn.commit()
 
+def _parse_logged(path, func, *args, **kwargs):
+    try:
+        return func(*args, **kwargs)
     except Exception as e:
         log.error("Error processing %s: %s", path, e)
         raise
+
+
+class ParseResult(NamedTuple):
+    """Records parsed from one file. A tuple pickles without its field names,
+    which keeps the results sent back from worker processes small."""
+
+    macro_defs: list  # lowercased names, only if want_macro_defs
+    libnames: list  # LIBNAME_COLUMNS tuples
+    ops: list  # TABLE_OPERATION_COLUMNS tuples
+    credential_findings: str  # JSON list, or None
+    includes: list  # distinct target paths
+    macro_calls: list  # distinct lowercased names, resolved by the caller
+
+
+def parse_one(path, source, patterns, known_librefs, datalab_defaults, scope_dbs,
+              want_macro_defs=False):
+    """Parse a single SAS file into plain, picklable records.
+
+    source is the file's text, or its raw bytes as fetched: those are
+    decoded here like read_file does, so the decoding runs in the worker
+    and valid UTF-8 goes to Hyperscan without being re-encoded.
+
+    Returns a ParseResult.
+    """
+    data = None
+    if isinstance(source, bytes):
+        try:
+            data, source = source, source.decode("utf-8")
+        except UnicodeDecodeError:
+            source = decode_source(source)
+
+    found = parse_all(source, patterns,
+                      _MACRO_FILE_CATEGORIES if want_macro_defs else _PROGRAM_CATEGORIES,
+                      data)
+    macro_defs = [md["name"].lower() for md in found.get("macro_def", ())]
+
+    # Parse %LET statements → resolve macro vars
+    macro_vars = resolve_macro_vars(found["let_statement"])
+
+    # Check for %datalab_connections → apply SF defaults
+    macro_vars = apply_datalab_connections(source, macro_vars, datalab_defaults)
+
+    # Parse LIBNAME statements → build libname map
+    parsed_libnames = found["libname"]
+    libname_map = build_libname_map(parsed_libnames, macro_vars)
+
+    libnames = [
+        (entry.get("libref", "").lower(), libname_engine(entry.get("pattern_name", "")), "parsed")
+        for entry in parsed_libnames
+    ]
+
+    # macro_vars and the libname maps are fixed for the file, so each
+    # (libref, table) pair only needs resolving once
+    resolved = {}
+
+    def resolve(libref, table):
+        key = (libref, table)
+        result = resolved.get(key)
+        if result is None:
+            result = resolved[key] = resolve_table_name(
+                libref, table, macro_vars, libname_map, known_librefs
+            )
+        return result
+
+    # Parse table writes
+    # One preallocated row list for writes then reads, filled by index
+    writes, reads = found["table_write"], found["table_read"]
+    ops = [None] * (len(writes) + len(reads))
+    for i, w in enumerate(writes):
+        qualified, db_type = resolve(w.get("libref") or w.get("schema"), w.get("table"))
+        in_scope = 1
+        if db_type == "snowflake":
+            in_scope = 1 if detect_snowflake_write_scope(qualified, db_type, scope_dbs) else 0
+        ops[i] = (path, qualified, db_type, "create", w["line"], in_scope)
+
+    # Parse table reads
+    for i, r in enumerate(reads, len(writes)):
+        qualified, db_type = resolve(r.get("libref") or r.get("schema"), r.get("table"))
+        ops[i] = (path, qualified, db_type, "read", r["line"], 1)
+
+    # Parse credentials
+    cred_findings = found["credentials"]
+    cred_json = None
+    if cred_findings:
+        cred_json = json.dumps(
+            [f"[{c['line']}] {c['pattern_name']}: {c['value']}" for c in cred_findings]
+        )
+
+    return ParseResult(
+        macro_defs=macro_defs,
+        libnames=libnames,
+        ops=ops,
+        credential_findings=cred_json,
+        includes=list(dict.fromkeys(inc["path"] for inc in found["include"])),
+        macro_calls=list(dict.fromkeys(call["name"].lower() for call in found["macro_call"])),
+    )
+
+
+# --- Storing (main process only) ---
+
+def _content_hash(source):
+    """Hex digest identifying a file's contents (raw bytes, or text as UTF-8)."""
+    if isinstance(source, str):
+        source = source.encode("utf-8", errors="surrogatepass")
+    return hashlib.blake2b(source, digest_size=16).hexdigest()
+
+
+def _store_parsed(conn, path, stat_attrs, parsed, macro_catalog, now, content_hash=None):
+    """Store the program and libname records for one parsed file.
+
+    Returns (ops, deps) row lists for the caller to write in a batch.
+    """
+    # Store libname mappings
+    if parsed.libnames:
+        upsert_libname_mappings(conn, parsed.libnames)
+
+    # Store program record (parent row must exist before child rows)
+    upsert_programs(conn, [(
+        path,
+        stat_attrs.st_size,
+        stat_attrs.st_mtime,
+        stat_attrs.st_atime,
+        stat_attrs.st_uid,
+        stat_attrs.st_gid,
+        stat_attrs.st_mode,
+        str(stat_attrs.st_uid),
+        now,
+        parsed.credential_findings,
+        content_hash,
+    )])
+
+    # Program dependencies: %INCLUDE, then macro calls resolved against catalog
+    deps = [(path, target, "include") for target in parsed.includes]
+    # Several macros can live in one file; keep one edge per target
+    macro_targets = dict.fromkeys(
+        macro_catalog[macro_name]
+        for macro_name in parsed.macro_calls if macro_name in macro_catalog
+    )
+    deps += [(path, target, "macro_call") for target in macro_targets]
+
+    return parsed.ops, deps
@@ -2,13 +2,28 @@
 
 import os
 import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-import paramiko
-from dotenv import load_dotenv
+# SSH channel window. Paramiko's default (2 MB) stalls prefetched reads on
+# high-latency links once that much data is in flight unacknowledged.
+WINDOW_SIZE = 2 ** 27
+
+# AEAD ciphers, moved to the front of paramiko's offer: AES-GCM runs on
+# AES-NI/PCLMUL and needs no separate MAC pass, unlike the default aes-ctr
+FAST_CIPHERS = ("aes128-gcm@openssh.com", "aes256-gcm@openssh.com")
+
+# Seconds between keepalives, so idle channels survive NAT/firewall timeouts
+# during long parse or write phases
+KEEPALIVE_INTERVAL = 60
 
 
 def connect(env_path=None):
     """Connect to SFTP server using credentials from .env. Returns SFTPClient."""
+    # Imported here so query commands and tests that never connect skip them
+    import paramiko
+    from dotenv import load_dotenv
+
     if env_path is None:
         env_path = os.path.join(os.path.dirname(__file__), ".env")
     load_dotenv(env_path)
@@ -18,59 +33,204 @@ def connect(env_path=None):
     user = os.environ["SFTP_USER"]
     password = os.environ["SFTP_PASSWORD"]
 
-    transport = paramiko.Transport((host, port))
+    transport = paramiko.Transport((host, port), default_window_size=WINDOW_SIZE)
+    # SAS source compresses well, but zlib costs more CPU than it saves on
+    # the links this runs over
+    transport.use_compression(False)
+    _prefer_ciphers(transport.get_security_options(), FAST_CIPHERS)
     transport.connect(username=user, password=password)
+    transport.set_keepalive(KEEPALIVE_INTERVAL)
     sftp = paramiko.SFTPClient.from_transport(transport)
     return sftp
 
 
-def walk_remote(sftp, root, extensions=None, max_depth=None):
+def _prefer_ciphers(options, preferred):
+    """Reorder a SecurityOptions' ciphers so the available preferred ones come first."""
+    available = tuple(options.ciphers)
+    first = tuple(c for c in preferred if c in available)
+    options.ciphers = first + tuple(c for c in available if c not in first)
+
+
+def open_client(sftp):
+    """Open another SFTPClient on sftp's transport.
+
+    SFTPClient is not thread-safe; each thread that reads files needs its
+    own. The new client is a second channel on the same SSH connection, so
+    no extra login is made. Close it with client.close().
+    """
+    import paramiko
+
+    return paramiko.SFTPClient.from_transport(sftp.get_channel().get_transport())
+
+
+def walk_remote(sftp, root, extensions=None, max_depth=None, workers=1):
     """Recursively walk a remote directory, returning file entries.
 
     Returns list of dicts: {path, stat} for files matching extensions.
     If extensions is None, returns all files.
     max_depth limits recursion depth (None = unlimited).
+    workers > 1 lists directories on that many threads, each on its own
+    channel (see open_client): a directory's subdirectories are requested
+    as soon as its listing arrives, so their round trips overlap. The
+    entries come back in the same order either way.
+    """
+    return list(iter_remote(sftp, root, extensions, max_depth, workers))
+
+
+def iter_remote(sftp, root, extensions=None, max_depth=None, workers=1):
+    """Generator form of walk_remote: yields each entry as soon as it is found.
+
+    Lets the caller start reading files while the rest of the tree is still
+    being listed.
     """
     if extensions is None:
-        extensions = {".sas"}
+        extensions = frozenset({".sas"})
+    else:
+        extensions = frozenset(e.lower() for e in extensions)
+
+    if workers > 1:
+        lister = _PrefetchingLister(sftp, workers, max_depth)
+        try:
+            yield from _walk(lister.listdir, root, extensions, max_depth)
+        finally:
+            lister.close()
     else:
-        extensions = {e.lower() for e in extensions}
+        yield from _walk(lambda path, depth: _listdir(sftp, path), root, extensions, max_depth)
 
-    results = []
-    _walk_recursive(sftp, root, extensions, results, 0, max_depth)
-    return results
 
+def _walk(listdir, root, extensions, max_depth):
+    """Depth-first walk from root in listing order, without recursion.
 
-def _walk_recursive(sftp, path, extensions, results, depth, max_depth):
-    """Recursive helper for walk_remote."""
-    if max_depth is not None and depth > max_depth:
+    listdir(path, depth) returns a directory's entries, or None. The stack
+    holds one entry iterator per open directory, so files come out in the
+    same order as a recursive walk.
+    """
+    S_ISDIR = stat.S_ISDIR
+    S_ISREG = stat.S_ISREG
+    # All-lower and all-upper spellings of the plain ".ext" extensions, so the
+    # common names are accepted by one endswith; others take the slow check
+    suffixes = tuple(
+        spelling
+        for ext in extensions if ext[:1] == "." and ext.count(".") == 1
+        for spelling in (ext, ext.upper())
+    )
+
+    entries = listdir(root, 0)
+    if entries is None:
         return
+    stack = [(iter(entries), _dir_prefix(root), 0)]
+    while stack:
+        entries, prefix, depth = stack[-1]
+        for entry in entries:
+            name = entry.filename
+            # Skip hidden directories to avoid crawling .cache, .vscode-server, etc.
+            if name[0] == ".":
+                continue
+            mode = entry.st_mode
+            if S_ISDIR(mode):
+                if max_depth is not None and depth + 1 > max_depth:
+                    continue
+                children = listdir(prefix + name, depth + 1)
+                if children is not None:
+                    stack.append((iter(children), prefix + name + "/", depth + 1))
+                    break
+            elif S_ISREG(mode):
+                if name.endswith(suffixes) or _has_extension(name, extensions):
+                    yield {
+                        "path": prefix + name,
+                        "stat": entry,
+                    }
+        else:
+            stack.pop()
+
+
+def _has_extension(name, extensions):
+    """True if the part of name from its last dot, lowercased, is in extensions."""
+    dot = name.rfind(".")
+    return dot >= 0 and name[dot:].lower() in extensions
+
+
+def _dir_prefix(path):
+    return path if path.endswith("/") else path + "/"
+
+
+class _PrefetchingLister:
+    """listdir for _walk that lists subdirectories ahead on a thread pool.
+
+    Every listing that arrives queues listings of the subdirectories the
+    walk will descend into, each thread using its own SFTPClient.
+    """
+
+    def __init__(self, sftp, workers, max_depth):
+        self.sftp = sftp
+        self.max_depth = max_depth
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._local = threading.local()
+        self._clients = []
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def listdir(self, path, depth):
+        future = self._pending.pop(path, None)
+        if future is None:
+            future = self._executor.submit(self._list, path)
+        entries = future.result()
+        if entries is not None and (self.max_depth is None or depth < self.max_depth):
+            prefix = _dir_prefix(path)
+            for entry in entries:
+                name = entry.filename
+                if name[0] != "." and stat.S_ISDIR(entry.st_mode):
+                    child = prefix + name
+                    self._pending[child] = self._executor.submit(self._list, child)
+        return entries
+
+    def _list(self, path):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = open_client(self.sftp)
+            self._local.client = client
+            with self._lock:
+                self._clients.append(client)
+        return _listdir(client, path)
+
+    def close(self):
+        """Stop the threads and close their SFTP channels."""
+        self._executor.shutdown(cancel_futures=True)
+        for client in self._clients:
+            client.close()
+        self._clients.clear()
+        self._pending.clear()
+
+
+def _listdir(sftp, path):
+    """listdir_attr, or None if the directory cannot be listed."""
     try:
-        entries = sftp.listdir_attr(path)
+        return sftp.listdir_attr(path)
     except IOError:
-        return
-
-    for entry in entries:
-        # Skip hidden directories to avoid crawling .cache, .vscode-server, etc.
-        if entry.filename.startswith("."):
-            continue
-        full_path = f"{path}/{entry.filename}" if not path.endswith("/") else f"{path}{entry.filename}"
-        if stat.S_ISDIR(entry.st_mode):
-            _walk_recursive(sftp, full_path, extensions, results, depth + 1, max_depth)
-        elif stat.S_ISREG(entry.st_mode):
-            _, ext = os.path.splitext(entry.filename)
-            if ext.lower() in extensions:
-                results.append({
-                    "path": full_path,
-                    "stat": entry,
-                })
+        return None
 
 
 def read_file(sftp, path):
-    """Read a remote file and return contents as string."""
+    """Read a remote file and return contents as string.
+
+    The file is prefetched: paramiko keeps many 32 KB read requests in
+    flight instead of waiting a round trip for each one.
+    """
+    return decode_source(read_file_bytes(sftp, path))
+
+
+def read_file_bytes(sftp, path):
+    """Read a remote file like read_file, but return the raw bytes undecoded."""
     with sftp.open(path, "rb") as f:
+        # No size: prefetch stats the open handle. A size from an earlier
+        # listing can be stale, and prefetching past a shrunk file's end
+        # fails, while a grown file's tail would be read unprefetched.
         f.prefetch()
-        data = f.read()
+        return f.read()
+
+
+def decode_source(data):
+    """Decode file contents as UTF-8, replacing invalid bytes (str passes through)."""
     if isinstance(data, str):
         return data
     return data.decode("utf-8", errors="replace")
@@ -1,5 +1,6 @@
 """Shared fixtures for SAS Mapper tests."""
 
+import os
 import sys
 from pathlib import Path
 
@@ -19,9 +20,41 @@ def patterns():
 
 @pytest.fixture
 def db_conn(tmp_path):
-    """Fresh SQLite database connection with schema initialized."""
+    """Fresh SQLite database connection with schema initialized.
+
+    The database is in memory, so commits never touch disk; set
+    DEP_MAP_TEST_DB_FILE=1 to run against a file in tmp_path instead.
+    """
     from db import init_db
-    db_path = tmp_path / "test.db"
-    conn = init_db(str(db_path))
+    if os.environ.get("DEP_MAP_TEST_DB_FILE", "0") == "1":
+        db_path = str(tmp_path / "test.db")
+    else:
+        db_path = ":memory:"
+    conn = init_db(db_path)
     yield conn
     conn.close()
+
+
+@pytest.fixture(scope="session")
+def sftp():
+    """Live SFTP connection, shared by the whole run so the SSH handshake happens once."""
+    from sftp_client import connect, close
+    client = connect()
+    yield client
+    close(client)
+
+
+def pytest_collection_modifyitems(config, items):
+    """With SKIP_SFTP_TESTS=1, deselect the tests that use the live sftp fixture.
+
+    They are dropped at collection, so the run reports them as deselected
+    and never sets up the fixture's connection.
+    """
+    if os.environ.get("SKIP_SFTP_TESTS", "0") != "1":
+        return
+    keep, live = [], []
+    for item in items:
+        (live if "sftp" in getattr(item, "fixturenames", ()) else keep).append(item)
+    if live:
+        config.hook.pytest_deselected(items=live)
+        items[:] = keep
@@ -1,17 +1,29 @@
 """Tests for db.py — schema, upserts, scan state."""
 
 import json
+import sqlite3
 
 import pandas as pd
+import pytest
 
 from db import (
     init_db,
+    open_readonly,
+    begin,
     get_scan_state,
+    get_content_state,
+    touch_programs,
     upsert_programs,
     upsert_table_operations,
     upsert_program_dependencies,
+    upsert_table_operations_bulk,
+    upsert_program_dependencies_bulk,
     upsert_libname_mappings,
     clear_program,
+    clear_programs,
+    rebuild_program_edges,
+    get_macro_definitions,
+    upsert_macro_definitions,
 )
 
 
@@ -37,6 +49,31 @@ class TestInitDb:
         assert len(cursor.fetchall()) >= 4
         conn2.close()
 
+    def test_natural_key_indexes(self, db_conn):
+        indexes = {
+            row[0] for row in db_conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='index'"
+            )
+        }
+        assert {"uq_table_ops_natural", "uq_deps_natural"} <= indexes
+
+    def test_covering_indexes(self, db_conn):
+        cursor = db_conn.execute("SELECT name FROM sqlite_master WHERE type='index'")
+        indexes = {row[0] for row in cursor.fetchall()}
+        assert "idx_table_ops_tname_op" in indexes
+        assert "idx_table_ops_path_op" in indexes
+        assert "idx_deps_target_source" in indexes
+        assert "idx_deps_source_target" in indexes
+
+    def test_wal_pragmas(self, tmp_path):
+        # WAL needs a file; db_conn is in memory
+        conn = init_db(str(tmp_path / "test.db"))
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+        assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+        assert conn.execute("PRAGMA cache_size").fetchone()[0] == -65536
+        conn.close()
+
 
 class TestScanState:
     def test_empty(self, db_conn):
@@ -61,6 +98,35 @@ class TestScanState:
         state = get_scan_state(db_conn)
         assert state["/test/a.sas"] == 1700000000
 
+    def test_content_hash_and_touch(self, db_conn):
+        upsert_programs(db_conn, [
+            ("/test/h.sas", 100, 1700000000, 1700000000, 1000, 1000, 33188, "joy",
+             "2024-01-01T00:00:00", None, "abc123"),
+            ("/test/n.sas", 50, 1700000000, 1700000000, 1000, 1000, 33188, "joy",
+             "2024-01-01T00:00:00", None, None),
+        ])
+        assert get_content_state(db_conn) == {"/test/h.sas": (100, "abc123")}
+
+        touch_programs(db_conn, [(1800000000, 1800000001, "2025-01-01T00:00:00", "/test/h.sas")])
+        assert get_scan_state(db_conn)["/test/h.sas"] == 1800000000
+        assert get_content_state(db_conn) == {"/test/h.sas": (100, "abc123")}
+
+    def test_content_hash_column_added(self, tmp_path):
+        db_path = str(tmp_path / "old.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute("""
+            CREATE TABLE programs (
+                program_path TEXT PRIMARY KEY, file_size INTEGER, file_mtime INTEGER,
+                file_atime INTEGER, file_uid INTEGER, file_gid INTEGER, file_mode INTEGER,
+                owner TEXT, scan_timestamp TEXT NOT NULL, credential_findings TEXT
+            )
+        """)
+        conn.close()
+        conn = init_db(db_path)
+        cols = [row[1] for row in conn.execute("PRAGMA table_info(programs)")]
+        conn.close()
+        assert cols[-1] == "content_hash"
+
 
 class TestUpsertPrograms:
     def test_insert_and_replace(self, db_conn):
@@ -177,6 +243,246 @@ class TestUpsertProgramDependencies:
         assert cursor.fetchone()[0] == "/macros/util.sas"
 
 
+class TestBulkUpserts:
+    def _seed_programs(self, conn, paths):
+        upsert_programs(conn, pd.DataFrame([{
+            "program_path": p,
+            "file_size": 100,
+            "file_mtime": 1700000000,
+            "file_atime": 1700000000,
+            "file_uid": 1000,
+            "file_gid": 1000,
+            "file_mode": 33188,
+            "owner": "joy",
+            "scan_timestamp": "2024-01-01T00:00:00",
+            "credential_findings": None,
+        } for p in paths]))
+        conn.commit()
+
+    def test_table_operations_replaced_per_program(self, db_conn):
+        self._seed_programs(db_conn, ["/test/g.sas", "/test/h.sas"])
+        upsert_table_operations(db_conn, "/test/g.sas", pd.DataFrame([{
+            "program_path": "/test/g.sas",
+            "table_name": "schema.stale",
+            "database_type": "oracle",
+            "operation_type": "read",
+            "source_line": 1,
+            "in_scope": 1,
+        }]))
+        db_conn.commit()
+
+        upsert_table_operations_bulk(db_conn, [
+            ("/test/g.sas", pd.DataFrame()),
+            ("/test/h.sas", pd.DataFrame([{
+                "program_path": "/test/h.sas",
+                "table_name": "schema.fresh",
+                "database_type": "oracle",
+                "operation_type": "create",
+                "source_line": 2,
+                "in_scope": 1,
+            }])),
+        ])
+
+        assert not db_conn.in_transaction
+        rows = db_conn.execute(
+            "SELECT program_path, table_name FROM table_operations"
+        ).fetchall()
+        assert rows == [("/test/h.sas", "schema.fresh")]
+
+    def test_program_dependencies(self, db_conn):
+        self._seed_programs(db_conn, ["/test/i.sas"])
+        upsert_program_dependencies_bulk(db_conn, [
+            ("/test/i.sas", pd.DataFrame([{
+                "source_program": "/test/i.sas",
+                "target_program": "/macros/util.sas",
+                "dependency_type": "macro_call",
+            }])),
+        ])
+        cursor = db_conn.execute(
+            "SELECT target_program FROM program_dependencies WHERE source_program = '/test/i.sas'"
+        )
+        assert cursor.fetchone()[0] == "/macros/util.sas"
+
+    def test_rows_span_multiple_statements(self, db_conn):
+        self._seed_programs(db_conn, ["/test/j.sas"])
+        df_ops = pd.DataFrame([{
+            "program_path": "/test/j.sas",
+            "table_name": f"schema.t{i}",
+            "database_type": "oracle",
+            "operation_type": "read",
+            "source_line": i,
+            "in_scope": 1,
+        } for i in range(1200)])
+        upsert_table_operations_bulk(db_conn, [("/test/j.sas", df_ops)])
+        assert db_conn.execute("SELECT COUNT(*) FROM table_operations").fetchone()[0] == 1200
+
+    def test_rescan_keeps_unchanged_rows_in_place(self, db_conn):
+        self._seed_programs(db_conn, ["/test/k.sas"])
+
+        def op(table, line, in_scope=1):
+            return {
+                "program_path": "/test/k.sas",
+                "table_name": table,
+                "database_type": "snowflake",
+                "operation_type": "create",
+                "source_line": line,
+                "in_scope": in_scope,
+            }
+
+        upsert_table_operations_bulk(db_conn, [
+            ("/test/k.sas", pd.DataFrame([op("db.s.keep", 1), op("db.s.flip", 2), op("db.s.gone", 3)])),
+        ])
+        ids = dict(db_conn.execute("SELECT table_name, id FROM table_operations"))
+
+        upsert_table_operations_bulk(db_conn, [
+            ("/test/k.sas", pd.DataFrame([op("db.s.keep", 1), op("db.s.flip", 2, in_scope=0),
+                                          op("db.s.new", 4), op("db.s.new", 4)])),
+        ])
+        rows = db_conn.execute(
+            "SELECT table_name, id, in_scope FROM table_operations ORDER BY source_line"
+        ).fetchall()
+        assert [(name, in_scope) for name, _, in_scope in rows] == [
+            ("db.s.keep", 1), ("db.s.flip", 0), ("db.s.new", 1),
+        ]
+        assert rows[0][1] == ids["db.s.keep"]
+        assert rows[1][1] == ids["db.s.flip"]
+
+    def test_accepts_tuples(self, db_conn):
+        upsert_programs(db_conn, [
+            ("/test/t.sas", 100, 1700000000, 1700000000, 1000, 1000, 33188, "joy",
+             "2024-01-01T00:00:00", None, None),
+        ])
+        upsert_table_operations_bulk(db_conn, [
+            ("/test/t.sas", [("/test/t.sas", "schema.x", "oracle", "read", 3, 1)]),
+        ])
+        upsert_program_dependencies_bulk(db_conn, [
+            ("/test/t.sas", [("/test/t.sas", "/macros/util.sas", "macro_call")]),
+        ])
+        upsert_libname_mappings(db_conn, [("ora", "oracle", "parsed")])
+        assert get_scan_state(db_conn) == {"/test/t.sas": 1700000000}
+        assert db_conn.execute(
+            "SELECT table_name, source_line FROM table_operations"
+        ).fetchall() == [("schema.x", 3)]
+        assert db_conn.execute(
+            "SELECT target_program FROM program_dependencies"
+        ).fetchall() == [("/macros/util.sas",)]
+        assert db_conn.execute("SELECT engine FROM libname_mappings").fetchall() == [("oracle",)]
+
+    def test_empty_batch(self, db_conn):
+        upsert_table_operations_bulk(db_conn, [])
+        assert db_conn.execute("SELECT COUNT(*) FROM table_operations").fetchone()[0] == 0
+
+
+class TestBegin:
+    def test_opens_one_transaction(self, db_conn):
+        begin(db_conn)
+        assert db_conn.in_transaction
+        begin(db_conn)  # already open: no nested BEGIN error
+        db_conn.execute("INSERT INTO libname_mappings VALUES ('ora', 'oracle', 'parsed')")
+        db_conn.rollback()
+        assert db_conn.execute("SELECT COUNT(*) FROM libname_mappings").fetchone()[0] == 0
+
+
+class TestOpenReadonly:
+    def test_reads_but_rejects_writes(self, tmp_path):
+        db_path = str(tmp_path / "ro test.db")
+        conn = init_db(db_path)
+        conn.execute("INSERT INTO libname_mappings VALUES ('ora', 'oracle', 'parsed')")
+        conn.commit()
+
+        ro = open_readonly(db_path)
+        try:
+            assert ro.execute("SELECT engine FROM libname_mappings").fetchone()[0] == "oracle"
+            with pytest.raises(sqlite3.OperationalError):
+                ro.execute("DELETE FROM libname_mappings")
+        finally:
+            ro.close()
+            conn.close()
+
+
+class TestProgramEdges:
+    def _seed(self, conn):
+        upsert_programs(conn, pd.DataFrame([{
+            "program_path": p,
+            "file_size": 100,
+            "file_mtime": 1700000000,
+            "file_atime": 1700000000,
+            "file_uid": 1000,
+            "file_gid": 1000,
+            "file_mode": 33188,
+            "owner": "joy",
+            "scan_timestamp": "2024-01-01T00:00:00",
+            "credential_findings": None,
+        } for p in ["/test/w.sas", "/test/r.sas"]]))
+        upsert_table_operations(conn, "/test/w.sas", pd.DataFrame([
+            {"program_path": "/test/w.sas", "table_name": "schema.x", "database_type": "oracle",
+             "operation_type": "create", "source_line": 1, "in_scope": 1},
+            {"program_path": "/test/w.sas", "table_name": "schema.x", "database_type": "oracle",
+             "operation_type": "read", "source_line": 2, "in_scope": 1},
+        ]))
+        upsert_table_operations(conn, "/test/r.sas", pd.DataFrame([{
+            "program_path": "/test/r.sas", "table_name": "schema.x", "database_type": "oracle",
+            "operation_type": "read", "source_line": 1, "in_scope": 1,
+        }]))
+        upsert_program_dependencies(conn, "/test/r.sas", pd.DataFrame([{
+            "source_program": "/test/r.sas",
+            "target_program": "/macros/util.sas",
+            "dependency_type": "macro_call",
+        }]))
+        conn.commit()
+
+    def test_rebuild(self, db_conn):
+        self._seed(db_conn)
+        rebuild_program_edges(db_conn)
+        rows = db_conn.execute(
+            "SELECT source, target, via_table, kind FROM program_edge_paths ORDER BY kind"
+        ).fetchall()
+        # No self-edge for w.sas reading its own table
+        assert rows == [
+            ("/test/w.sas", "/test/r.sas", "schema.x", "data"),
+            ("/macros/util.sas", "/test/r.sas", "", "macro_call"),
+        ]
+
+    def test_backfilled_on_open(self, tmp_path):
+        db_path = str(tmp_path / "test.db")
+        conn = init_db(db_path)
+        self._seed(conn)
+        conn.close()
+        conn = init_db(db_path)
+        assert conn.execute("SELECT COUNT(*) FROM program_edges").fetchone()[0] == 2
+        conn.close()
+
+    def test_text_edges_migrated(self, tmp_path):
+        db_path = str(tmp_path / "test.db")
+        conn = init_db(db_path)
+        self._seed(conn)
+        conn.executescript("""
+            DROP VIEW program_edge_paths;
+            DROP TABLE program_edges;
+            CREATE TABLE program_edges (
+                source TEXT NOT NULL, target TEXT NOT NULL,
+                via_table TEXT NOT NULL DEFAULT '', kind TEXT NOT NULL,
+                PRIMARY KEY (source, target, via_table)
+            );
+        """)
+        conn.close()
+        conn = init_db(db_path)
+        assert conn.execute("SELECT COUNT(*) FROM program_edge_paths").fetchone()[0] == 2
+        conn.close()
+
+    def test_unreferenced_paths_pruned(self, db_conn):
+        self._seed(db_conn)
+        rebuild_program_edges(db_conn)
+        paths = {row[0] for row in db_conn.execute("SELECT path FROM paths")}
+        assert paths == {"/test/w.sas", "/test/r.sas", "/macros/util.sas"}
+
+    def test_clear_program_removes_edges(self, db_conn):
+        self._seed(db_conn)
+        rebuild_program_edges(db_conn)
+        clear_program(db_conn, "/test/r.sas")
+        assert db_conn.execute("SELECT COUNT(*) FROM program_edges").fetchone()[0] == 0
+
+
 class TestUpsertLibnameMappings:
     def test_insert(self, db_conn):
         df = pd.DataFrame([{
@@ -190,6 +496,20 @@ class TestUpsertLibnameMappings:
         assert cursor.fetchone()[0] == "oracle"
 
 
+class TestMacroDefinitions:
+    def test_replace_per_file(self, db_conn):
+        upsert_macro_definitions(db_conn, "/macros/a.sas", ["util", "helper"])
+        upsert_macro_definitions(db_conn, "/macros/b.sas", ["other"])
+        upsert_macro_definitions(db_conn, "/macros/a.sas", ["util"])
+        defs = get_macro_definitions(db_conn)
+        assert defs == {"/macros/a.sas": ["util"], "/macros/b.sas": ["other"]}
+
+    def test_cleared_with_program(self, db_conn):
+        upsert_macro_definitions(db_conn, "/macros/a.sas", ["util"])
+        clear_program(db_conn, "/macros/a.sas")
+        assert get_macro_definitions(db_conn) == {}
+
+
 class TestClearProgram:
     def test_removes_all_related(self, db_conn):
         # Insert program
@@ -232,3 +552,31 @@ class TestClearProgram:
         assert db_conn.execute("SELECT COUNT(*) FROM programs WHERE program_path = '/test/e.sas'").fetchone()[0] == 0
         assert db_conn.execute("SELECT COUNT(*) FROM table_operations WHERE program_path = '/test/e.sas'").fetchone()[0] == 0
         assert db_conn.execute("SELECT COUNT(*) FROM program_dependencies WHERE source_program = '/test/e.sas'").fetchone()[0] == 0
+
+    def test_clear_many(self, db_conn):
+        paths = [f"/test/p{i}.sas" for i in range(3)]
+        upsert_programs(db_conn, [
+            (p, 100, 1700000000, 1700000000, 1000, 1000, 33188, "joy",
+             "2024-01-01T00:00:00", None, None)
+            for p in paths
+        ])
+        upsert_table_operations_bulk(db_conn, [
+            (p, [(p, "schema.t", "oracle", "create" if i == 0 else "read", 1, 1)])
+            for i, p in enumerate(paths)
+        ])
+        upsert_program_dependencies_bulk(db_conn, [
+            (paths[2], [(paths[2], paths[0], "include")]),
+        ])
+        upsert_macro_definitions(db_conn, paths[1], ["util"])
+        rebuild_program_edges(db_conn)
+
+        clear_programs(db_conn, paths[:2])
+
+        assert [r[0] for r in db_conn.execute("SELECT program_path FROM programs")] == [paths[2]]
+        assert db_conn.execute(
+            "SELECT DISTINCT program_path FROM table_operations"
+        ).fetchall() == [(paths[2],)]
+        assert get_macro_definitions(db_conn) == {}
+        assert db_conn.execute("SELECT COUNT(*) FROM program_edges").fetchone()[0] == 0
+        # Dependencies are owned by their source program, which is kept
+        assert db_conn.execute("SELECT COUNT(*) FROM program_dependencies").fetchone()[0] == 1
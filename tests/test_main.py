@@ -0,0 +1,106 @@
+"""Tests for main.py — query commands against missing and older databases."""
+
+import sqlite3
+import sys
+
+import pytest
+
+import main
+
+
+# Schema as written before the paths/program_edges tables and content hashes
+_BASELINE_SCHEMA = """
+    CREATE TABLE programs (
+        program_path    TEXT PRIMARY KEY,
+        file_size       INTEGER,
+        file_mtime      INTEGER,
+        file_atime      INTEGER,
+        file_uid        INTEGER,
+        file_gid        INTEGER,
+        file_mode       INTEGER,
+        owner           TEXT,
+        scan_timestamp  TEXT NOT NULL,
+        credential_findings TEXT
+    );
+    CREATE TABLE table_operations (
+        id              INTEGER PRIMARY KEY AUTOINCREMENT,
+        program_path    TEXT NOT NULL REFERENCES programs(program_path),
+        table_name      TEXT NOT NULL,
+        database_type   TEXT NOT NULL,
+        operation_type  TEXT NOT NULL,
+        source_line     INTEGER,
+        in_scope        INTEGER DEFAULT 1
+    );
+    CREATE TABLE program_dependencies (
+        id              INTEGER PRIMARY KEY AUTOINCREMENT,
+        source_program  TEXT NOT NULL REFERENCES programs(program_path),
+        target_program  TEXT NOT NULL,
+        dependency_type TEXT NOT NULL
+    );
+    CREATE TABLE libname_mappings (
+        libref          TEXT PRIMARY KEY,
+        engine          TEXT NOT NULL,
+        source          TEXT NOT NULL DEFAULT 'parsed'
+    );
+    CREATE INDEX idx_table_ops_program ON table_operations(program_path);
+    CREATE INDEX idx_table_ops_table ON table_operations(table_name);
+    CREATE INDEX idx_table_ops_type ON table_operations(operation_type);
+    CREATE INDEX idx_deps_source ON program_dependencies(source_program);
+    CREATE INDEX idx_deps_target ON program_dependencies(target_program);
+"""
+
+
+@pytest.fixture
+def config_for(tmp_path):
+    """Return a function writing a config.yaml that points at db_path."""
+    def write(db_path):
+        config_path = tmp_path / "config.yaml"
+        config_path.write_text(f"database: {db_path}\n")
+        return str(config_path)
+    return write
+
+
+def _run(monkeypatch, *argv):
+    monkeypatch.setattr(sys, "argv", ["sas_mapper", *argv])
+    main.main()
+
+
+def _write_baseline_db(db_path):
+    """A database as the first release wrote it: A creates schema.x, B reads it."""
+    conn = sqlite3.connect(db_path)
+    conn.executescript(_BASELINE_SCHEMA)
+    conn.executemany(
+        "INSERT INTO programs (program_path, scan_timestamp) VALUES (?, ?)",
+        [("/a.sas", "2024-01-01T00:00:00"), ("/b.sas", "2024-01-01T00:00:00")],
+    )
+    conn.executemany(
+        "INSERT INTO table_operations (program_path, table_name, database_type, operation_type,"
+        " source_line) VALUES (?, ?, ?, ?, ?)",
+        [("/a.sas", "schema.x", "oracle", "create", 1), ("/b.sas", "schema.x", "oracle", "read", 1)],
+    )
+    conn.commit()
+    conn.close()
+
+
+class TestQueryCommands:
+    def test_missing_database_asks_for_scan(self, tmp_path, config_for, monkeypatch):
+        db_path = tmp_path / "missing.db"
+        with pytest.raises(SystemExit) as excinfo:
+            _run(monkeypatch, "--config", config_for(db_path), "impact", "/a.sas")
+        assert "run `scan` first" in str(excinfo.value.code)
+        assert not db_path.exists()
+
+    def test_baseline_database_migrated(self, tmp_path, config_for, monkeypatch, capsys):
+        db_path = tmp_path / "old.db"
+        _write_baseline_db(str(db_path))
+        config_path = config_for(db_path)
+
+        _run(monkeypatch, "--config", config_path, "impact", "/a.sas")
+        assert "/b.sas" in capsys.readouterr().out
+
+        _run(monkeypatch, "--config", config_path, "upstream", "/b.sas")
+        assert "/a.sas" in capsys.readouterr().out
+
+        conn = sqlite3.connect(db_path)
+        assert conn.execute("SELECT COUNT(*) FROM program_edges").fetchone()[0] == 1
+        conn.close()
@@ -1,6 +1,13 @@
 """Tests for parser.py — feed known SAS fragments, assert matches."""
 
+import os
+
+import pytest
+
+import parser as sas_parser
 from parser import (
+    load_patterns,
+    parse_all,
     parse_table_writes,
     parse_table_reads,
     parse_includes,
@@ -12,6 +19,118 @@ from parser import (
 )
 
 
+# --- Pattern loading ---
+
+class TestLoadPatterns:
+    def test_union_for_every_category(self, patterns):
+        for category, compiled in patterns.items():
+            assert compiled["any"] is not None, category
+
+    def test_union_keeps_per_pattern_flags(self, patterns):
+        # passthrough_read is the only DOTALL pattern in table_read
+        src = "EXECUTE(SELECT col1\nFROM myschema.sourcetbl)"
+        assert patterns["table_read"]["any"].search(src)
+        results = parse_table_reads(src, patterns)
+        assert any(r["table"] == "sourcetbl" for r in results)
+
+    def test_no_match_short_circuits(self, patterns):
+        assert parse_includes("data x; run;", patterns) == []
+
+    def test_prefilter_backends_agree(self, patterns):
+        """Hyperscan (when installed) and the re union select the same matches."""
+        re_only = {cat: dict(compiled, hs=None) for cat, compiled in patterns.items()}
+        src = (
+            "LIBNAME ora ORACLE PATH='PROD' SCHEMA='DBO' USER=jsmith PASSWORD=&pwd;\n"
+            "%LET tgt = out;\n%INCLUDE '/shared/setup.sas';\n"
+            "DATA ora.&tgt;\n  SET ora.a ora.b;\nRUN;\n"
+            "DATA _null_; run;\n%load_data(dsn=x);\n"
+            "EXECUTE(SELECT c FROM s.t) BY oracle;\n"
+        )
+        for parse in (parse_table_writes, parse_table_reads, parse_includes,
+                      parse_macro_calls, parse_libnames, parse_let_statements,
+                      parse_credentials):
+            assert parse(src, patterns) == parse(src, re_only)
+
+    def test_parse_all_matches_per_category_functions(self, patterns):
+        src = (
+            "LIBNAME ora ORACLE PATH='PROD' SCHEMA='DBO' USER=jsmith PASSWORD=&pwd;\n"
+            "%LET tgt = out ;\n%INCLUDE '/shared/setup.sas';\n"
+            "%MACRO helper; %MEND;\nDATA ora.&tgt;\n  SET ora.a ora.b;\nRUN;\n"
+            "%load_data(dsn=x);\n"
+        )
+        by_function = {
+            "table_write": parse_table_writes(src, patterns),
+            "table_read": parse_table_reads(src, patterns),
+            "include": parse_includes(src, patterns),
+            "macro_def": parse_macro_defs(src, patterns),
+            "macro_call": parse_macro_calls(src, patterns),
+            "libname": parse_libnames(src, patterns),
+            "let_statement": parse_let_statements(src, patterns),
+            "credentials": parse_credentials(src, patterns),
+        }
+        re_only = {cat: dict(compiled, hs=None) for cat, compiled in patterns.items()}
+        assert parse_all(src, patterns) == by_function
+        assert parse_all(src, re_only) == by_function
+        assert parse_all(src, patterns, ["include"]) == {"include": by_function["include"]}
+        assert parse_all(src, patterns, data=src.encode("utf-8")) == by_function
+
+    def test_memoized_until_file_changes(self, tmp_path):
+        yaml_path = tmp_path / "patterns.yaml"
+        yaml_path.write_text(_SMALL_PATTERNS)
+        first = load_patterns(yaml_path)
+        assert load_patterns(str(yaml_path)) is first
+
+        yaml_path.write_text(_SMALL_PATTERNS.replace("INCLUDE", "INC"))
+        os.utime(yaml_path, ns=(0, os.stat(yaml_path).st_mtime_ns + 1_000_000))
+        second = load_patterns(yaml_path)
+        assert second is not first
+        assert parse_includes("%INC 'a.sas'", second)[0]["path"] == "a.sas"
+
+    def test_hyperscan_cache_on_disk(self, tmp_path):
+        if sas_parser.hyperscan is None:
+            pytest.skip("hyperscan not installed")
+        yaml_path = tmp_path / "patterns.yaml"
+        yaml_path.write_text(_SMALL_PATTERNS)
+        load_patterns(yaml_path)
+        cache_path = tmp_path / "patterns.yaml.compiled.hsdb"
+        assert cache_path.read_bytes().startswith(sas_parser._HS_CACHE_MAGIC)
+
+        sas_parser._load_patterns.cache_clear()
+        reloaded = load_patterns(yaml_path)
+        assert reloaded["include"]["hs"] is not None
+        assert parse_includes("%INCLUDE 'a.sas';", reloaded)[0]["path"] == "a.sas"
+
+    @pytest.mark.parametrize("damage", [
+        pytest.param(lambda data: data[:-3], id="truncated"),
+        pytest.param(lambda data: data.replace(b"\n", b" ", 1), id="bad_header"),
+        pytest.param(lambda data: data + b"\x00", id="trailing_garbage"),
+        pytest.param(lambda data: b"\x80\x04N.", id="pickle"),
+    ])
+    def test_damaged_hyperscan_cache_is_a_miss(self, tmp_path, damage):
+        if sas_parser.hyperscan is None:
+            pytest.skip("hyperscan not installed")
+        yaml_path = tmp_path / "patterns.yaml"
+        yaml_path.write_text(_SMALL_PATTERNS)
+        load_patterns(yaml_path)
+        cache_path = tmp_path / "patterns.yaml.compiled.hsdb"
+        cache_path.write_bytes(damage(cache_path.read_bytes()))
+
+        mtime_ns = os.stat(yaml_path).st_mtime_ns
+        assert sas_parser._read_hs_cache(str(yaml_path), mtime_ns) == {}
+        sas_parser._load_patterns.cache_clear()
+        assert parse_includes("%INCLUDE 'a.sas';", load_patterns(yaml_path))[0]["path"] == "a.sas"
+
+
+_SMALL_PATTERNS = """
+include:
+  - name: include_directive
+    pattern: '(?i)%INCLUDE\\s+[''"]([^''"]+)[''"]'
+    flags: [IGNORECASE]
+    groups:
+      1: path
+"""
+
+
 # --- Table writes ---
 
 class TestTableWrites:
@@ -184,3 +303,16 @@ class TestCredentials:
         src = "line1\nline2\nPASSWORD=secret\nline4"
         results = parse_credentials(src, patterns)
         assert results[0]["line"] == 3
+
+    def test_line_number_first_and_last_line(self, patterns):
+        src = "PWD=first\nline2\n\nUSER=last"
+        results = parse_credentials(src, patterns)
+        lines = {r["value"]: r["line"] for r in results}
+        assert lines == {"first": 1, "last": 4}
+
+    def test_line_numbers_for_many_matches(self, patterns):
+        # Enough matches to take the numpy searchsorted path
+        src = "\n".join(f"%let v{i} = {i};" for i in range(3000))
+        results = parse_let_statements(src, patterns)
+        assert len(results) == 3000
+        assert all(r["line"] == int(r["value"]) + 1 for r in results)
@@ -2,25 +2,40 @@
 
 import json
 
-import pandas as pd
+import pytest
 
-from db import init_db, upsert_programs, upsert_table_operations, upsert_program_dependencies
-from queries import downstream_impact, upstream_dependencies, table_impact, credential_report
+from db import (
+    init_db,
+    upsert_programs,
+    upsert_table_operations_bulk,
+    upsert_program_dependencies_bulk,
+    rebuild_program_edges,
+)
+from queries import (
+    build_adjacency,
+    downstream_impact,
+    upstream_dependencies,
+    table_impact,
+    credential_report,
+    iter_credential_findings,
+)
 
 
-def _make_program(path, cred_findings=None):
-    return {
-        "program_path": path,
-        "file_size": 100,
-        "file_mtime": 1700000000,
-        "file_atime": 1700000000,
-        "file_uid": 1000,
-        "file_gid": 1000,
-        "file_mode": 33188,
-        "owner": "joy",
-        "scan_timestamp": "2024-01-01T00:00:00",
-        "credential_findings": json.dumps(cred_findings) if cred_findings else None,
-    }
+# /f.sas's credential_findings, serialized once for the seed and the assertions
+_F_CREDENTIALS = json.dumps(["[10] PASSWORD=hunter2"])
+
+# file_size .. scan_timestamp, shared by every seeded program
+_PROGRAM_STAT = (100, 1700000000, 1700000000, 1000, 1000, 33188, "joy", "2024-01-01T00:00:00")
+
+
+def _program_rows(paths, credential_findings=None):
+    """Program rows in PROGRAM_COLUMNS order.
+
+    credential_findings maps a path to the text stored in its
+    credential_findings column; other paths get NULL.
+    """
+    findings = credential_findings or {}
+    return [(path, *_PROGRAM_STAT, findings.get(path), None) for path in paths]
 
 
 def _seed_graph(conn):
@@ -30,150 +45,148 @@ def _seed_graph(conn):
     C reads table Y
     D includes E (program dependency)
     """
-    programs = pd.DataFrame([
-        _make_program("/a.sas"),
-        _make_program("/b.sas"),
-        _make_program("/c.sas"),
-        _make_program("/d.sas"),
-        _make_program("/e.sas"),
-        _make_program("/f.sas", cred_findings=["[10] PASSWORD=hunter2"]),
+    upsert_programs(conn, _program_rows(
+        ["/a.sas", "/b.sas", "/c.sas", "/d.sas", "/e.sas", "/f.sas"],
+        {"/f.sas": _F_CREDENTIALS},
+    ))
+
+    # One batch per table, as the scanner writes them
+    upsert_table_operations_bulk(conn, [
+        # A writes X
+        ("/a.sas", [("/a.sas", "schema.x", "oracle", "create", 1, 1)]),
+        # B reads X, writes Y
+        ("/b.sas", [
+            ("/b.sas", "schema.x", "oracle", "read", 1, 1),
+            ("/b.sas", "schema.y", "oracle", "create", 5, 1),
+        ]),
+        # C reads Y
+        ("/c.sas", [("/c.sas", "schema.y", "oracle", "read", 1, 1)]),
     ])
-    upsert_programs(conn, programs)
+    # D includes E
+    upsert_program_dependencies_bulk(conn, [("/d.sas", [("/d.sas", "/e.sas", "include")])])
+
+    rebuild_program_edges(conn)
+
+
+def _has_path(result, path):
+    """True if path is in a result frame's program_path column (compared as one array)."""
+    return bool((result["program_path"].values == path).any())
+
+
+@pytest.fixture(scope="module")
+def _seeded_db():
+    conn = init_db(":memory:")
+    _seed_graph(conn)
     conn.commit()
+    yield conn
+    conn.close()
 
-    # A writes X
-    upsert_table_operations(conn, "/a.sas", pd.DataFrame([{
-        "program_path": "/a.sas",
-        "table_name": "schema.x",
-        "database_type": "oracle",
-        "operation_type": "create",
-        "source_line": 1,
-        "in_scope": 1,
-    }]))
-
-    # B reads X, writes Y
-    upsert_table_operations(conn, "/b.sas", pd.DataFrame([
-        {
-            "program_path": "/b.sas",
-            "table_name": "schema.x",
-            "database_type": "oracle",
-            "operation_type": "read",
-            "source_line": 1,
-            "in_scope": 1,
-        },
-        {
-            "program_path": "/b.sas",
-            "table_name": "schema.y",
-            "database_type": "oracle",
-            "operation_type": "create",
-            "source_line": 5,
-            "in_scope": 1,
-        },
-    ]))
-
-    # C reads Y
-    upsert_table_operations(conn, "/c.sas", pd.DataFrame([{
-        "program_path": "/c.sas",
-        "table_name": "schema.y",
-        "database_type": "oracle",
-        "operation_type": "read",
-        "source_line": 1,
-        "in_scope": 1,
-    }]))
 
-    # D includes E
-    upsert_program_dependencies(conn, "/d.sas", pd.DataFrame([{
-        "source_program": "/d.sas",
-        "target_program": "/e.sas",
-        "dependency_type": "include",
-    }]))
+@pytest.fixture
+def seeded_conn(_seeded_db):
+    """Connection to the graph seeded once per module; each test's writes are rolled back."""
+    _seeded_db.execute("SAVEPOINT test")
+    yield _seeded_db
+    _seeded_db.execute("ROLLBACK TO test")
+    _seeded_db.execute("RELEASE test")
 
 
 class TestDownstreamImpact:
-    def test_direct(self, db_conn):
-        _seed_graph(db_conn)
-        result = downstream_impact(db_conn, "/a.sas")
-        paths = set(result["program_path"])
-        assert "/b.sas" in paths
-
-    def test_transitive(self, db_conn):
-        _seed_graph(db_conn)
-        result = downstream_impact(db_conn, "/a.sas")
-        paths = set(result["program_path"])
+    def test_direct(self, seeded_conn):
+        result = downstream_impact(seeded_conn, "/a.sas")
+        assert _has_path(result, "/b.sas")
+
+    def test_transitive(self, seeded_conn):
+        result = downstream_impact(seeded_conn, "/a.sas")
         # A → X → B → Y → C (transitive)
-        assert "/c.sas" in paths
+        assert _has_path(result, "/c.sas")
 
-    def test_no_self(self, db_conn):
-        _seed_graph(db_conn)
-        result = downstream_impact(db_conn, "/a.sas")
-        paths = set(result["program_path"])
-        assert "/a.sas" not in paths
+    def test_no_self(self, seeded_conn):
+        result = downstream_impact(seeded_conn, "/a.sas")
+        assert not _has_path(result, "/a.sas")
 
-    def test_leaf_no_impact(self, db_conn):
-        _seed_graph(db_conn)
-        result = downstream_impact(db_conn, "/c.sas")
+    def test_leaf_no_impact(self, seeded_conn):
+        result = downstream_impact(seeded_conn, "/c.sas")
         assert result.empty
 
-    def test_program_dependency(self, db_conn):
-        _seed_graph(db_conn)
+    def test_program_dependency(self, seeded_conn):
         # E is included by D, so changing E impacts D
-        result = downstream_impact(db_conn, "/e.sas")
-        paths = set(result["program_path"])
-        assert "/d.sas" in paths
+        result = downstream_impact(seeded_conn, "/e.sas")
+        assert _has_path(result, "/d.sas")
+
+    def test_shortest_depth(self, seeded_conn):
+        result = downstream_impact(seeded_conn, "/a.sas")
+        assert list(result.itertuples(index=False, name=None)) == [("/b.sas", 1), ("/c.sas", 2)]
+
+    def test_max_depth(self, seeded_conn):
+        result = downstream_impact(seeded_conn, "/a.sas", max_depth=1)
+        assert set(result["program_path"]) == {"/b.sas"}
+
+    def test_records(self, seeded_conn):
+        columns, rows = downstream_impact(seeded_conn, "/a.sas", as_dataframe=False)
+        assert columns == ["program_path", "depth"]
+        assert rows == [("/b.sas", 1), ("/c.sas", 2)]
+
+    def test_reuses_adjacency(self, seeded_conn):
+        adjacency = build_adjacency(seeded_conn)
+        down = downstream_impact(seeded_conn, "/a.sas", adjacency=adjacency)
+        up = upstream_dependencies(seeded_conn, "/c.sas", adjacency=adjacency)
+        assert set(down["program_path"]) == {"/b.sas", "/c.sas"}
+        assert set(up["program_path"]) == {"/a.sas", "/b.sas"}
 
 
 class TestUpstreamDependencies:
-    def test_direct(self, db_conn):
-        _seed_graph(db_conn)
-        result = upstream_dependencies(db_conn, "/b.sas")
-        paths = set(result["program_path"])
-        assert "/a.sas" in paths
-
-    def test_transitive(self, db_conn):
-        _seed_graph(db_conn)
-        result = upstream_dependencies(db_conn, "/c.sas")
-        paths = set(result["program_path"])
+    def test_direct(self, seeded_conn):
+        result = upstream_dependencies(seeded_conn, "/b.sas")
+        assert _has_path(result, "/a.sas")
+
+    def test_transitive(self, seeded_conn):
+        result = upstream_dependencies(seeded_conn, "/c.sas")
         # C reads Y ← B writes Y, B reads X ← A writes X
-        assert "/a.sas" in paths
-        assert "/b.sas" in paths
+        assert _has_path(result, "/a.sas")
+        assert _has_path(result, "/b.sas")
 
-    def test_root_no_upstream(self, db_conn):
-        _seed_graph(db_conn)
-        result = upstream_dependencies(db_conn, "/a.sas")
+    def test_root_no_upstream(self, seeded_conn):
+        result = upstream_dependencies(seeded_conn, "/a.sas")
         assert result.empty
 
-    def test_program_dependency_upstream(self, db_conn):
-        _seed_graph(db_conn)
+    def test_program_dependency_upstream(self, seeded_conn):
         # D includes E, so E is upstream of D
-        result = upstream_dependencies(db_conn, "/d.sas")
-        paths = set(result["program_path"])
-        assert "/e.sas" in paths
+        result = upstream_dependencies(seeded_conn, "/d.sas")
+        assert _has_path(result, "/e.sas")
 
 
 class TestTableImpact:
-    def test_all_users(self, db_conn):
-        _seed_graph(db_conn)
-        result = table_impact(db_conn, "schema.x")
-        paths = set(result["program_path"])
-        assert "/a.sas" in paths  # writes
-        assert "/b.sas" in paths  # reads
-
-    def test_nonexistent_table(self, db_conn):
-        _seed_graph(db_conn)
-        result = table_impact(db_conn, "no.such.table")
+    def test_all_users(self, seeded_conn):
+        result = table_impact(seeded_conn, "schema.x")
+        assert _has_path(result, "/a.sas")  # writes
+        assert _has_path(result, "/b.sas")  # reads
+
+    def test_records(self, seeded_conn):
+        columns, rows = table_impact(seeded_conn, "schema.x", as_dataframe=False)
+        assert columns == ["program_path", "operation_type", "database_type", "source_line"]
+        assert {row[0] for row in rows} == {"/a.sas", "/b.sas"}
+
+    def test_nonexistent_table(self, seeded_conn):
+        result = table_impact(seeded_conn, "no.such.table")
         assert result.empty
 
 
 class TestCredentialReport:
-    def test_finds_flagged(self, db_conn):
-        _seed_graph(db_conn)
-        result = credential_report(db_conn)
-        paths = set(result["program_path"])
-        assert "/f.sas" in paths
+    def test_finds_flagged(self, seeded_conn):
+        result = credential_report(seeded_conn)
+        assert _has_path(result, "/f.sas")
         assert len(result) == 1
 
-    def test_clean_excluded(self, db_conn):
-        _seed_graph(db_conn)
-        result = credential_report(db_conn)
-        paths = set(result["program_path"])
-        assert "/a.sas" not in paths
+    def test_clean_excluded(self, seeded_conn):
+        result = credential_report(seeded_conn)
+        assert not _has_path(result, "/a.sas")
+
+    def test_empty_findings_excluded(self, seeded_conn):
+        upsert_programs(seeded_conn, _program_rows(["/g.sas", "/h.sas"], {"/g.sas": "[]", "/h.sas": ""}))
+        assert list(credential_report(seeded_conn)["program_path"]) == ["/f.sas"]
+
+    def test_iter_matches_report(self, seeded_conn):
+        assert list(iter_credential_findings(seeded_conn)) == [
+            ("/f.sas", _F_CREDENTIALS),
+        ]
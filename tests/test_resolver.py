@@ -1,36 +1,41 @@
 """Tests for resolver.py — macro var resolution, table name resolution, SF scoping."""
 
+from types import MappingProxyType
+
+import pytest
+
 from resolver import (
     resolve_macro_vars,
     apply_datalab_connections,
     resolve_table_name,
+    resolve_table_name_fast,
     detect_snowflake_write_scope,
     build_libname_map,
+    libname_engine,
+    normalize_known_librefs,
 )
 
 
 class TestResolveMacroVars:
-    def test_basic(self):
-        stmts = [
-            {"variable": "db", "value": "PROD_DB"},
-            {"variable": "schema", "value": "DBO"},
-        ]
-        result = resolve_macro_vars(stmts)
-        assert result["db"] == "PROD_DB"
-        assert result["schema"] == "DBO"
-
-    def test_last_wins(self):
-        stmts = [
-            {"variable": "db", "value": "DEV_DB"},
-            {"variable": "db", "value": "PROD_DB"},
-        ]
-        result = resolve_macro_vars(stmts)
-        assert result["db"] == "PROD_DB"
-
-    def test_case_insensitive_keys(self):
-        stmts = [{"variable": "MyVar", "value": "hello"}]
-        result = resolve_macro_vars(stmts)
-        assert "myvar" in result
+    @pytest.mark.parametrize("stmts, expected", [
+        pytest.param(
+            [{"variable": "db", "value": "PROD_DB"}, {"variable": "schema", "value": "DBO"}],
+            {"db": "PROD_DB", "schema": "DBO"},
+            id="basic",
+        ),
+        pytest.param(
+            [{"variable": "db", "value": "DEV_DB"}, {"variable": "db", "value": "PROD_DB"}],
+            {"db": "PROD_DB"},
+            id="last_wins",
+        ),
+        pytest.param(
+            [{"variable": "MyVar", "value": "hello"}],
+            {"myvar": "hello"},
+            id="case_insensitive_keys",
+        ),
+    ])
+    def test_resolve(self, stmts, expected):
+        assert resolve_macro_vars(stmts) == expected
 
 
 class TestDatalabConnections:
@@ -56,89 +61,102 @@ class TestDatalabConnections:
         assert "sf_database" not in result
 
 
-class TestResolveTableName:
-    def test_oracle_libname(self):
-        libname_map = {
-            "myora": {"engine": "oracle", "path": "PROD", "schema": "DBO"},
-        }
-        name, db_type = resolve_table_name("myora", "customers", {}, libname_map, {})
-        assert name == "DBO.customers"
-        assert db_type == "oracle"
-
-    def test_snowflake_libname(self):
-        libname_map = {
-            "sf": {
-                "engine": "snowflake",
-                "database": "LIS_DTALAB_WRKGRP_SPC_DB",
-                "schema": "DL_T1_ILS_ANALYTICS",
-            },
-        }
-        name, db_type = resolve_table_name("sf", "mytable", {}, libname_map, {})
-        assert name == "LIS_DTALAB_WRKGRP_SPC_DB.DL_T1_ILS_ANALYTICS.mytable"
-        assert db_type == "snowflake"
-
-    def test_known_libref_fallback(self):
-        known = {"prodlib": "oracle"}
-        name, db_type = resolve_table_name("prodlib", "tbl", {}, {}, known)
-        assert name == "prodlib.tbl"
-        assert db_type == "oracle"
-
-    def test_unknown_libref(self):
-        name, db_type = resolve_table_name("mystery", "tbl", {}, {}, {})
-        assert name == "mystery.tbl"
-        assert db_type == "unknown"
-
-    def test_macro_var_in_libref(self):
-        macro_vars = {"mylib": "prodora"}
-        known = {"prodora": "oracle"}
-        name, db_type = resolve_table_name("&mylib", "tbl", macro_vars, {}, known)
-        assert name == "prodora.tbl"
-        assert db_type == "oracle"
-
-    def test_unresolved_macro_var(self):
-        name, db_type = resolve_table_name("&unknown_lib", "tbl", {}, {}, {})
-        assert "unknown" in name
-        assert db_type == "unknown"
-
-    def test_work_library(self):
-        name, db_type = resolve_table_name("work", "temp", {}, {}, {})
-        assert name == "work.temp"
-        assert db_type == "work"
-
-    def test_none_handling(self):
-        name, db_type = resolve_table_name(None, None, {}, {}, {})
-        assert "unknown" in name
-        assert db_type == "unknown"
+# Read-only libname_map entries, shared by the resolve and build tests: the
+# resolvers must not mutate the maps they are given
+_ORACLE_LIBNAME = MappingProxyType({"engine": "oracle", "path": "PROD", "schema": "DBO"})
+_SNOWFLAKE_LIBNAME = MappingProxyType({
+    "engine": "snowflake",
+    "database": "LIS_DTALAB_WRKGRP_SPC_DB",
+    "schema": "DL_T1_ILS_ANALYTICS",
+})
 
 
-class TestSnowflakeWriteScope:
-    def test_in_scope(self):
-        assert detect_snowflake_write_scope(
-            "LIS_DTALAB_WRKGRP_SPC_DB.DL_T1_ILS_ANALYTICS.tbl", "snowflake"
+class TestResolveTableName:
+    @pytest.mark.parametrize("libref, table, macro_vars, libname_map, known, expected", [
+        pytest.param(
+            "myora", "customers", {}, MappingProxyType({"myora": _ORACLE_LIBNAME}), {},
+            ("DBO.customers", "oracle"),
+            id="oracle_libname",
+        ),
+        pytest.param(
+            "sf", "mytable", {}, MappingProxyType({"sf": _SNOWFLAKE_LIBNAME}), {},
+            ("LIS_DTALAB_WRKGRP_SPC_DB.DL_T1_ILS_ANALYTICS.mytable", "snowflake"),
+            id="snowflake_libname",
+        ),
+        pytest.param(
+            "prodlib", "tbl", {}, {}, {"prodlib": "oracle"},
+            ("prodlib.tbl", "oracle"),
+            id="known_libref_fallback",
+        ),
+        pytest.param(
+            "PRODLIB", "Tbl", {}, {}, normalize_known_librefs({"ProdLib": "oracle"}),
+            ("prodlib.tbl", "oracle"),
+            id="known_libref_normalized",
+        ),
+        pytest.param(
+            "MyOra", "t", {},
+            build_libname_map([{"pattern_name": "libname_oracle", "libref": "MyOra", "schema": "DBO"}], {}),
+            {},
+            ("DBO.t", "oracle"),
+            id="libname_map_built_lowercased",
+        ),
+        pytest.param(
+            "mystery", "tbl", {}, {}, {},
+            ("mystery.tbl", "unknown"),
+            id="unknown_libref",
+        ),
+        pytest.param(
+            "&mylib", "tbl", {"mylib": "prodora"}, {}, {"prodora": "oracle"},
+            ("prodora.tbl", "oracle"),
+            id="macro_var_in_libref",
+        ),
+        pytest.param(
+            "&unknown_lib", "tbl", {}, {}, {},
+            ("unknown.tbl", "unknown"),
+            id="unresolved_macro_var",
+        ),
+        pytest.param(
+            "work", "temp", {}, {}, {},
+            ("work.temp", "work"),
+            id="work_library",
+        ),
+        pytest.param(
+            None, None, {}, {}, {},
+            ("unknown.unknown", "unknown"),
+            id="none_handling",
+        ),
+    ])
+    def test_resolve(self, libref, table, macro_vars, libname_map, known, expected):
+        assert resolve_table_name(libref, table, macro_vars, libname_map, known) == expected
+
+    def test_fast_path_skips_substitution(self):
+        """Callers that substituted and lowercased already go straight to the lookup."""
+        libname_map = MappingProxyType({"myora": _ORACLE_LIBNAME})
+        assert resolve_table_name_fast("myora", "customers", {}, libname_map, {}) == (
+            "DBO.customers", "oracle",
         )
-
-    def test_datalab_ilsnp_in_scope(self):
-        assert detect_snowflake_write_scope(
-            "DATALAB_ILSNP.schema.tbl", "snowflake"
+        # No substitution or lowering happens here: a mixed-case libref misses the map
+        assert resolve_table_name_fast("MyOra", "customers", {}, libname_map, {}) == (
+            "MyOra.customers", "unknown",
         )
 
-    def test_out_of_scope(self):
-        assert not detect_snowflake_write_scope(
-            "ILS_DATALAB_SBX_DB.schema.tbl", "snowflake"
-        )
 
-    def test_not_snowflake(self):
-        assert not detect_snowflake_write_scope(
-            "LIS_DTALAB_WRKGRP_SPC_DB.schema.tbl", "oracle"
-        )
+class TestSnowflakeWriteScope:
+    @pytest.mark.parametrize("qualified_name, db_type, expected", [
+        pytest.param("LIS_DTALAB_WRKGRP_SPC_DB.DL_T1_ILS_ANALYTICS.tbl", "snowflake", True,
+                     id="in_scope"),
+        pytest.param("DATALAB_ILSNP.schema.tbl", "snowflake", True, id="datalab_ilsnp_in_scope"),
+        pytest.param("ILS_DATALAB_SBX_DB.schema.tbl", "snowflake", False, id="out_of_scope"),
+        pytest.param("LIS_DTALAB_WRKGRP_SPC_DB.schema.tbl", "oracle", False, id="not_snowflake"),
+    ])
+    def test_scope(self, qualified_name, db_type, expected):
+        assert detect_snowflake_write_scope(qualified_name, db_type) is expected
 
 
 class TestBuildLibnameMap:
     def test_oracle(self):
         parsed = [{"pattern_name": "libname_oracle", "libref": "ORA", "path": "PROD", "schema": "DBO"}]
-        result = build_libname_map(parsed, {})
-        assert result["ora"]["engine"] == "oracle"
-        assert result["ora"]["schema"] == "DBO"
+        assert build_libname_map(parsed, {}) == {"ora": _ORACLE_LIBNAME}
 
     def test_snowflake_with_macro_vars(self):
         parsed = [{
@@ -151,12 +169,23 @@ class TestBuildLibnameMap:
             "sf_database": "LIS_DTALAB_WRKGRP_SPC_DB",
             "sf_schema": "DL_T1_ILS_ANALYTICS",
         }
-        result = build_libname_map(parsed, macro_vars)
-        assert result["sf"]["engine"] == "snowflake"
-        assert result["sf"]["database"] == "LIS_DTALAB_WRKGRP_SPC_DB"
+        assert build_libname_map(parsed, macro_vars) == {"sf": _SNOWFLAKE_LIBNAME}
 
     def test_base(self):
         parsed = [{"pattern_name": "libname_base", "libref": "MYDIR", "path": "/data/sasdata"}]
         result = build_libname_map(parsed, {})
         assert result["mydir"]["engine"] == "base"
         assert result["mydir"]["path"] == "/data/sasdata"
+
+    def test_unknown_engine_skipped(self):
+        parsed = [{"pattern_name": "libname_teradata", "libref": "TD"}]
+        assert build_libname_map(parsed, {}) == {}
+
+
+class TestLibnameEngine:
+    def test_engines(self):
+        assert libname_engine("libname_oracle") == "oracle"
+        assert libname_engine("libname_snowflake") == "snowflake"
+        assert libname_engine("libname_base") == "base"
+        assert libname_engine("libname_teradata") == "unknown"
+        assert libname_engine("") == "unknown"
@@ -0,0 +1,229 @@
+"""Tests for scanner.py — incremental scan decisions against a fake SFTP server."""
+
+import sqlite3
+import stat
+from types import SimpleNamespace
+
+import pytest
+
+import scanner
+
+
+MACRO = "/macros/m.sas"
+PROG = "/progs/p.sas"
+
+_MACRO_SOURCE = b"%macro load_x;\n  data work.x; run;\n%mend;\n"
+_PROG_SOURCE = b"%load_x;\ndata out.y; set work.x; run;\n"
+
+
+class _FakeSFTPFile:
+    """Minimal stand-in for paramiko.SFTPFile returned by sftp.open()."""
+
+    def __init__(self, data):
+        self._data = data
+        self.prefetch_size = "not called"
+
+    def prefetch(self, file_size=None):
+        self.prefetch_size = file_size
+        # paramiko's prefetch thread fails reading past the end of the file
+        if file_size is not None and file_size > len(self._data):
+            raise EOFError
+
+    def read(self):
+        return self._data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class _FakeSFTP:
+    """listdir_attr and open over a {path: (data, mtime)} dict of files."""
+
+    def __init__(self, files):
+        self.files = files
+        self.last_opened = None
+
+    def listdir_attr(self, path):
+        prefix = path.rstrip("/") + "/"
+        entries = {}
+        for file_path, (data, mtime) in self.files.items():
+            if not file_path.startswith(prefix):
+                continue
+            name, sep, _ = file_path[len(prefix):].partition("/")
+            if sep:
+                entries[name] = SimpleNamespace(filename=name, st_mode=stat.S_IFDIR | 0o755)
+            else:
+                entries[name] = SimpleNamespace(
+                    filename=name, st_mode=stat.S_IFREG | 0o644, st_size=len(data),
+                    st_mtime=mtime, st_atime=mtime, st_uid=1000, st_gid=1000,
+                )
+        if not entries:
+            raise IOError(path)
+        return list(entries.values())
+
+    def open(self, path, mode):
+        self.last_opened = _FakeSFTPFile(self.files[path][0])
+        return self.last_opened
+
+
+class _Remote:
+    """Files on the fake server, the scans run against them, and what each parsed."""
+
+    def __init__(self, tmp_path):
+        self.files = {MACRO: (_MACRO_SOURCE, 1000), PROG: (_PROG_SOURCE, 1000)}
+        self.db_path = str(tmp_path / "scan.db")
+        self.config_path = tmp_path / "config.yaml"
+        self.config_path.write_text(
+            f"database: {self.db_path}\n"
+            "macro_directory: /macros\n"
+            "scan_roots: [/progs]\n"
+            "extensions: [.sas]\n"
+        )
+        self.parsed = []
+
+    def scan(self):
+        """Run one scan; returns its stats. self.parsed lists the files it parsed."""
+        self.parsed.clear()
+        stats = scanner.scan(config_path=self.config_path, workers=1, fetch_workers=1)
+        # Each walked file is counted exactly once
+        assert stats["scanned"] + stats["skipped"] + stats["errors"] == len(self.files)
+        return stats
+
+    def query(self, sql):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+
+@pytest.fixture
+def remote(tmp_path, monkeypatch):
+    remote = _Remote(tmp_path)
+    monkeypatch.setattr(scanner, "connect", lambda: _FakeSFTP(remote.files))
+    monkeypatch.setattr(scanner, "close", lambda sftp: None)
+    parse_one = scanner.parse_one
+
+    def recording_parse_one(path, *args, **kwargs):
+        remote.parsed.append(path)
+        return parse_one(path, *args, **kwargs)
+
+    monkeypatch.setattr(scanner, "parse_one", recording_parse_one)
+    remote.scan()
+    assert remote.parsed == [MACRO, PROG]
+    return remote
+
+
+class TestContentHashSkip:
+    def test_unchanged_file_touched_not_reparsed(self, remote):
+        remote.files[PROG] = (_PROG_SOURCE, 2000)
+        stats = remote.scan()
+        assert remote.parsed == []
+        assert (stats["scanned"], stats["skipped"], stats["errors"]) == (0, 2, 0)
+        assert remote.query(f"SELECT file_mtime FROM programs WHERE program_path = '{PROG}'") == [
+            (2000,),
+        ]
+
+    def test_same_size_content_change_reparsed(self, remote):
+        changed = _PROG_SOURCE.replace(b"out.y", b"out.z")
+        assert len(changed) == len(_PROG_SOURCE)
+        remote.files[PROG] = (changed, 2000)
+        stats = remote.scan()
+        assert remote.parsed == [PROG]
+        assert (stats["scanned"], stats["skipped"], stats["errors"]) == (1, 1, 0)
+        assert remote.query(
+            f"SELECT table_name FROM table_operations WHERE program_path = '{PROG}'"
+            " AND operation_type = 'create'"
+        ) == [("out.z",)]
+
+    def test_size_change_with_same_mtime_reparsed(self, remote):
+        remote.files[PROG] = (_PROG_SOURCE + b"data out.w; set work.x; run;\n", 1000)
+        remote.scan()
+        assert remote.parsed == [PROG]
+        assert sorted(remote.query(
+            f"SELECT table_name FROM table_operations WHERE program_path = '{PROG}'"
+            " AND operation_type = 'create'"
+        )) == [("out.w",), ("out.y",)]
+
+    def test_read_error_counted_once(self, remote, monkeypatch):
+        read_file_bytes = scanner.read_file_bytes
+
+        def failing_read(sftp, path):
+            if path == PROG:
+                raise IOError("permission denied")
+            return read_file_bytes(sftp, path)
+
+        monkeypatch.setattr(scanner, "read_file_bytes", failing_read)
+        remote.files[PROG] = (_PROG_SOURCE, 2000)
+        stats = remote.scan()
+        assert (stats["scanned"], stats["skipped"], stats["errors"]) == (0, 1, 1)
+
+    def test_unchanged_mtime_and_size_skipped_unread(self, remote):
+        stats = remote.scan()
+        assert remote.parsed == []
+        assert stats["skipped"] == 2
+
+
+class TestReadLogged:
+    @pytest.mark.parametrize("walked_size", [4, 64], ids=["grew", "shrank"])
+    def test_stale_walk_size_not_used_for_prefetch(self, walked_size):
+        """The file may have changed size since the walk stat'ed it."""
+        sftp = _FakeSFTP({PROG: (_PROG_SOURCE, 1000)})
+        entry = {"path": PROG, "stat": SimpleNamespace(st_size=walked_size)}
+        assert scanner._read_logged(sftp, entry) == _PROG_SOURCE
+        assert sftp.last_opened.prefetch_size is None
+
+
+class TestMacroCatalog:
+    def _definitions(self, remote):
+        return remote.query("SELECT macro_name, program_path FROM macro_definitions")
+
+    def test_pre_catalog_database_reparses_macro_files_once(self, remote):
+        # A database from before the catalog was stored has no definitions
+        # and no content hashes
+        conn = sqlite3.connect(remote.db_path)
+        with conn:
+            conn.execute("DELETE FROM macro_definitions")
+            conn.execute("UPDATE programs SET content_hash = NULL")
+        conn.close()
+
+        stats = remote.scan()
+        assert remote.parsed == [MACRO]
+        assert (stats["scanned"], stats["skipped"], stats["errors"]) == (1, 1, 0)
+        assert self._definitions(remote) == [("load_x", MACRO)]
+
+        stats = remote.scan()
+        assert remote.parsed == []
+        assert (stats["scanned"], stats["skipped"], stats["errors"]) == (0, 2, 0)
+
+    def test_macro_file_without_macros_skipped_when_unchanged(self, remote):
+        remote.files[MACRO] = (b"data work.x; run;\n", 2000)
+        remote.scan()
+        assert self._definitions(remote) == []
+
+        stats = remote.scan()
+        assert remote.parsed == []
+        assert (stats["scanned"], stats["skipped"], stats["errors"]) == (0, 2, 0)
+
+    def test_stored_catalog_resolves_calls_without_reparse(self, remote):
+        remote.files[PROG] = (_PROG_SOURCE + b"%load_x;\n", 2000)
+        remote.scan()
+        assert remote.parsed == [PROG]
+        assert remote.query(
+            f"SELECT target_program FROM program_dependencies WHERE source_program = '{PROG}'"
+            " AND dependency_type = 'macro_call'"
+        ) == [(MACRO,)]
+
+    def test_changed_macro_file_replaces_definitions(self, remote):
+        remote.files[MACRO] = (_MACRO_SOURCE.replace(b"load_x", b"load_y"), 2000)
+        # Still calls the old name, which the macro file no longer defines
+        remote.files[PROG] = (_PROG_SOURCE + b"data out.z; run;\n", 2000)
+        remote.scan()
+        assert remote.parsed == [MACRO, PROG]
+        assert self._definitions(remote) == [("load_y", MACRO)]
+        assert remote.query(
+            f"SELECT target_program FROM program_dependencies WHERE source_program = '{PROG}'"
+        ) == []
@@ -1,11 +1,12 @@
-"""SFTP tests — unit tests for read_file, live integration tests for the rest."""
+"""SFTP tests — unit tests against fakes, live integration tests for the rest."""
 
-import os
-from unittest.mock import MagicMock
+import stat
+from types import SimpleNamespace
 
 import pytest
 
-from sftp_client import connect, walk_remote, read_file, close
+import sftp_client
+from sftp_client import walk_remote, iter_remote, read_file, read_file_bytes
 
 
 # ---------------------------------------------------------------------------
@@ -15,11 +16,16 @@ from sftp_client import connect, walk_remote, read_file, close
 class _FakeSFTPFile:
     """Minimal stand-in for paramiko.SFTPFile returned by sftp.open()."""
 
+    __slots__ = ("_data", "prefetch_size", "prefetch_calls")
+
     def __init__(self, data):
         self._data = data
+        self.prefetch_size = "not called"
+        self.prefetch_calls = 0
 
-    def prefetch(self):
-        pass
+    def prefetch(self, file_size=None):
+        self.prefetch_size = file_size
+        self.prefetch_calls += 1
 
     def read(self):
         return self._data
@@ -31,11 +37,33 @@ class _FakeSFTPFile:
         pass
 
 
-def _mock_sftp(file_data):
-    """Return an sftp mock whose .open() yields a _FakeSFTPFile."""
-    sftp = MagicMock()
-    sftp.open.return_value = _FakeSFTPFile(file_data)
-    return sftp
+class _FakeSFTP:
+    """Minimal stand-in for paramiko.SFTPClient: .open() yields a _FakeSFTPFile.
+
+    Records the (path, mode) it was opened with and the file it handed out.
+    """
+
+    __slots__ = ("_data", "opened_with", "file")
+
+    def __init__(self, data):
+        self._data = data
+        self.opened_with = None
+        self.file = None
+
+    def open(self, path, mode):
+        self.opened_with = (path, mode)
+        self.file = _FakeSFTPFile(self._data)
+        return self.file
+
+
+# Byte patterns shared by the TestReadFile encoding tests
+_INVALID_HIGH = bytes(range(0x80, 0xA0))  # all invalid UTF-8 continuation bytes
+_INVALID_HIGH_DECODED = "\ufffd" * len(_INVALID_HIGH)  # one replacement per byte
+_ALL_BYTES = bytes(range(256))
+_MULTIBYTE_SOURCE = "/* commentaire français */\ndata été; set données; run;"
+_MULTIBYTE_UTF8 = _MULTIBYTE_SOURCE.encode("utf-8")
+_CAFE_UTF8 = "café".encode("utf-8")
+_NAIVE_UTF8 = "naïve".encode("utf-8")
 
 
 class TestReadFile:
@@ -44,28 +72,25 @@ class TestReadFile:
     # -- basic happy paths ---------------------------------------------------
 
     def test_pure_ascii(self):
-        result = read_file(_mock_sftp(b"data a; set b; run;"), "/prog.sas")
+        result = read_file(_FakeSFTP(b"data a; set b; run;"), "/prog.sas")
         assert result == "data a; set b; run;"
 
     def test_utf8_content(self):
         content = b"/* normal comment */\ndata work.out; set work.in; run;"
-        result = read_file(_mock_sftp(content), "/prog.sas")
-        assert result == content.decode("utf-8")
+        result = read_file(_FakeSFTP(content), "/prog.sas")
+        assert result == "/* normal comment */\ndata work.out; set work.in; run;"
 
     def test_valid_multibyte_utf8_preserved(self):
         """Accented and CJK characters survive the round-trip."""
-        raw = "/* commentaire français */\ndata été; set données; run;".encode("utf-8")
-        result = read_file(_mock_sftp(raw), "/prog.sas")
-        assert "français" in result
-        assert "été" in result
-        assert "données" in result
+        result = read_file(_FakeSFTP(_MULTIBYTE_UTF8), "/prog.sas")
+        assert result == _MULTIBYTE_SOURCE
 
     # -- Windows-1252 / non-UTF-8 bytes (the production bug) -----------------
 
     def test_windows_1252_en_dash_in_comment(self):
         """0x96 is an en dash in Windows-1252 — the exact production failure."""
         raw = b"/* date range: 2020\x962023 */\ndata out; set in; run;"
-        result = read_file(_mock_sftp(raw), "/prog.sas")
+        result = read_file(_FakeSFTP(raw), "/prog.sas")
         assert isinstance(result, str)
         # 0x96 is invalid UTF-8; errors="replace" turns it into U+FFFD
         assert "\ufffd" in result
@@ -75,21 +100,21 @@ class TestReadFile:
         """Several Windows-1252 bytes that are invalid in UTF-8."""
         # 0x93 = left double quote, 0x94 = right double quote, 0x96 = en dash
         raw = b"/* \x93quoted\x94 value \x96 note */\n%put done;"
-        result = read_file(_mock_sftp(raw), "/prog.sas")
+        result = read_file(_FakeSFTP(raw), "/prog.sas")
         assert isinstance(result, str)
         assert "%put done;" in result
 
     def test_smart_quotes_in_sas_string_literal(self):
         """Windows-1252 smart quotes inside a SAS string value."""
         raw = b"title \x93Quarterly Report\x94;\nproc print; run;"
-        result = read_file(_mock_sftp(raw), "/prog.sas")
+        result = read_file(_FakeSFTP(raw), "/prog.sas")
         assert "Quarterly Report" in result
         assert "proc print; run;" in result
 
     def test_non_utf8_with_crlf_line_endings(self):
         """Windows CRLF endings combined with invalid bytes."""
         raw = b"/* range \x96 */\r\ndata x;\r\nset y;\r\nrun;"
-        result = read_file(_mock_sftp(raw), "/prog.sas")
+        result = read_file(_FakeSFTP(raw), "/prog.sas")
         assert "data x;" in result
         assert "set y;" in result
         assert "\r\n" in result
@@ -97,18 +122,18 @@ class TestReadFile:
     # -- edge-case byte patterns ---------------------------------------------
 
     def test_empty_file_bytes(self):
-        result = read_file(_mock_sftp(b""), "/empty.sas")
+        result = read_file(_FakeSFTP(b""), "/empty.sas")
         assert result == ""
 
     def test_empty_file_str(self):
         """Paramiko returning an empty string."""
-        result = read_file(_mock_sftp(""), "/empty.sas")
+        result = read_file(_FakeSFTP(""), "/empty.sas")
         assert result == ""
 
     def test_null_bytes(self):
         """Null bytes should survive as \\x00 in the decoded string."""
         raw = b"data x;\x00 set y; run;"
-        result = read_file(_mock_sftp(raw), "/prog.sas")
+        result = read_file(_FakeSFTP(raw), "/prog.sas")
         assert isinstance(result, str)
         assert "\x00" in result
         assert "data x;" in result
@@ -116,15 +141,14 @@ class TestReadFile:
 
     def test_only_invalid_bytes(self):
         """A file containing no valid UTF-8 at all still returns a string."""
-        raw = bytes(range(0x80, 0xA0))  # all invalid UTF-8 continuation bytes
-        result = read_file(_mock_sftp(raw), "/garbage.sas")
-        assert isinstance(result, str)
-        assert all(c == "\ufffd" for c in result)
+        raw = _INVALID_HIGH
+        result = read_file(_FakeSFTP(raw), "/garbage.sas")
+        assert result == _INVALID_HIGH_DECODED
 
     def test_every_byte_value(self):
         """All 256 single-byte values: must not raise, must return str."""
-        raw = bytes(range(256))
-        result = read_file(_mock_sftp(raw), "/allbytes.sas")
+        raw = _ALL_BYTES
+        result = read_file(_FakeSFTP(raw), "/allbytes.sas")
         assert isinstance(result, str)
         assert len(result) > 0
 
@@ -132,23 +156,21 @@ class TestReadFile:
         """Incomplete multibyte sequence at end of file."""
         # \xc3 is the first byte of a 2-byte UTF-8 sequence (e.g. \xc3\xa9 = é)
         raw = b"data x; run;\xc3"
-        result = read_file(_mock_sftp(raw), "/prog.sas")
+        result = read_file(_FakeSFTP(raw), "/prog.sas")
         assert isinstance(result, str)
         assert "data x; run;" in result
         assert result.endswith("\ufffd")
 
     def test_mixed_valid_multibyte_and_invalid(self):
         """Valid UTF-8 multibyte chars adjacent to invalid bytes."""
-        raw = "café".encode("utf-8") + b"\x96" + "naïve".encode("utf-8")
-        result = read_file(_mock_sftp(raw), "/prog.sas")
-        assert "caf\u00e9" in result
-        assert "na\u00efve" in result
-        assert "\ufffd" in result
+        raw = _CAFE_UTF8 + b"\x96" + _NAIVE_UTF8
+        result = read_file(_FakeSFTP(raw), "/prog.sas")
+        assert result == "caf\u00e9\ufffdna\u00efve"
 
     def test_utf8_bom(self):
         """UTF-8 BOM at start of file is preserved (common from Windows editors)."""
         raw = b"\xef\xbb\xbfdata x; set y; run;"
-        result = read_file(_mock_sftp(raw), "/bom.sas")
+        result = read_file(_FakeSFTP(raw), "/bom.sas")
         assert "data x; set y; run;" in result
         assert result.startswith("\ufeff")
 
@@ -157,66 +179,120 @@ class TestReadFile:
     def test_paramiko_returns_str(self):
         """If Paramiko already decoded to str, read_file returns it as-is."""
         already_decoded = "/* already a string */\ndata x; run;"
-        result = read_file(_mock_sftp(already_decoded), "/prog.sas")
+        result = read_file(_FakeSFTP(already_decoded), "/prog.sas")
         assert result == already_decoded
 
     def test_paramiko_returns_str_with_unicode(self):
         """Str path works for content that already contains unicode chars."""
         already_decoded = "/* commentaire \u2013 français */\ndata x; run;"
-        result = read_file(_mock_sftp(already_decoded), "/prog.sas")
+        result = read_file(_FakeSFTP(already_decoded), "/prog.sas")
         assert result == already_decoded
         assert "\u2013" in result
 
     # -- contract: mode, prefetch, return type -------------------------------
 
     def test_opens_in_binary_mode(self):
-        mock = _mock_sftp(b"x")
-        read_file(mock, "/prog.sas")
-        mock.open.assert_called_once_with("/prog.sas", "rb")
+        sftp = _FakeSFTP(b"x")
+        read_file(sftp, "/prog.sas")
+        assert sftp.opened_with == ("/prog.sas", "rb")
 
     def test_prefetch_called(self):
         """prefetch() must be called to ensure reliable binary reads."""
-        fake_file = MagicMock()
-        fake_file.read.return_value = b"data x; run;"
-        fake_file.__enter__ = MagicMock(return_value=fake_file)
-        fake_file.__exit__ = MagicMock(return_value=False)
-        mock = MagicMock()
-        mock.open.return_value = fake_file
-        read_file(mock, "/prog.sas")
-        fake_file.prefetch.assert_called_once()
+        sftp = _FakeSFTP(b"data x; run;")
+        read_file(sftp, "/prog.sas")
+        assert sftp.file.prefetch_calls == 1
+
+    def test_bytes_variant_skips_decoding(self):
+        raw = b"/* \x96 */\ndata x; run;"
+        assert read_file_bytes(_FakeSFTP(raw), "/prog.sas") == raw
+        assert read_file(_FakeSFTP(raw), "/prog.sas") == "/* \ufffd */\ndata x; run;"
 
     def test_path_passed_through(self):
         """The exact path argument is forwarded to sftp.open()."""
-        mock = _mock_sftp(b"x")
-        read_file(mock, "/some/deep/path/program.sas")
-        mock.open.assert_called_once_with("/some/deep/path/program.sas", "rb")
+        sftp = _FakeSFTP(b"x")
+        read_file(sftp, "/some/deep/path/program.sas")
+        assert sftp.opened_with == ("/some/deep/path/program.sas", "rb")
 
-    def test_return_type_always_str(self):
+    @pytest.mark.parametrize("data", [b"ascii", b"\x96\x93\x94", b"", b"\xc3\xa9", "already str"])
+    def test_return_type_always_str(self, data):
         """Regardless of input type, return value is always str."""
-        for data in [b"ascii", b"\x96\x93\x94", b"", b"\xc3\xa9", "already str"]:
-            result = read_file(_mock_sftp(data), "/f.sas")
-            assert isinstance(result, str), f"Expected str for input {data!r}, got {type(result)}"
+        assert isinstance(read_file(_FakeSFTP(data), "/f.sas"), str)
 
 
-# ---------------------------------------------------------------------------
-# Live integration tests — requires test server at 10.0.0.10
-# ---------------------------------------------------------------------------
+class _FakeTreeSFTP:
+    """listdir_attr over a {dir_path: [(name, is_dir)]} dict."""
+
+    def __init__(self, tree):
+        self.tree = tree
+
+    def listdir_attr(self, path):
+        if path not in self.tree:
+            raise IOError(path)
+        return [
+            SimpleNamespace(filename=name, st_mode=(stat.S_IFDIR if is_dir else stat.S_IFREG) | 0o644)
+            for name, is_dir in self.tree[path]
+        ]
 
-_skip_sftp = pytest.mark.skipif(
-    os.environ.get("SKIP_SFTP_TESTS", "0") == "1",
-    reason="SFTP tests skipped (set SKIP_SFTP_TESTS=0 to enable)",
-)
+    def close(self):
+        pass
+
+
+class TestWalkRemoteOrder:
+    _TREE = {
+        "/r": [("b.sas", False), ("sub", True), (".hidden", True), ("a.SAS", False),
+               ("locked", True), ("z", True), ("c.txt", False)],
+        "/r/sub": [("deep", True), ("s.sas", False)],
+        "/r/sub/deep": [("d.sas", False)],
+        "/r/.hidden": [("h.sas", False)],
+        "/r/z": [("z.sas", False)],
+    }
+
+    @pytest.mark.parametrize("max_depth", [None, 0, 1])
+    def test_parallel_listing_keeps_walk_order(self, monkeypatch, max_depth):
+        monkeypatch.setattr(sftp_client, "open_client", lambda sftp: sftp)
+        fake = _FakeTreeSFTP(self._TREE)
+        serial = [e["path"] for e in walk_remote(fake, "/r", max_depth=max_depth)]
+        parallel = [e["path"] for e in walk_remote(fake, "/r", max_depth=max_depth, workers=4)]
+        assert parallel == serial
+        if max_depth is None:
+            assert serial == ["/r/b.sas", "/r/sub/deep/d.sas", "/r/sub/s.sas",
+                              "/r/a.SAS", "/r/z/z.sas"]
+
+    def test_extension_match_ignores_case(self):
+        fake = _FakeTreeSFTP({"/e": [("a.sas", False), ("b.SAS", False), ("c.Sas", False),
+                                     ("d.x.sas", False), ("sas", False), ("e.sas7bdat", False)]})
+        assert [e["path"] for e in walk_remote(fake, "/e")] == [
+            "/e/a.sas", "/e/b.SAS", "/e/c.Sas", "/e/d.x.sas",
+        ]
+        assert walk_remote(fake, "/e", extensions={".x.sas"}) == []
+
+    def test_iter_remote_streams_entries(self):
+        fake = _FakeTreeSFTP(self._TREE)
+        listed = []
+        fake_listdir = fake.listdir_attr
+        fake.listdir_attr = lambda path: listed.append(path) or fake_listdir(path)
+
+        entries = iter_remote(fake, "/r")
+        assert next(entries)["path"] == "/r/b.sas"
+        assert listed == ["/r"]
+        assert [e["path"] for e in entries] == [
+            "/r/sub/deep/d.sas", "/r/sub/s.sas", "/r/a.SAS", "/r/z/z.sas",
+        ]
+
+
+class TestPreferCiphers:
+    def test_available_preferred_ciphers_first(self):
+        options = SimpleNamespace(ciphers=("aes128-ctr", "aes256-ctr", "aes256-gcm@openssh.com"))
+        sftp_client._prefer_ciphers(options, ("aes128-gcm@openssh.com", "aes256-gcm@openssh.com"))
+        assert options.ciphers == ("aes256-gcm@openssh.com", "aes128-ctr", "aes256-ctr")
 
 
-@pytest.fixture(scope="module")
-def sftp():
-    """Establish SFTP connection for the test module."""
-    client = connect()
-    yield client
-    close(client)
+# ---------------------------------------------------------------------------
+# Live integration tests — requires test server at 10.0.0.10
+# (sftp fixture in conftest.py; deselected there when SKIP_SFTP_TESTS=1)
+# ---------------------------------------------------------------------------
 
 
-@_skip_sftp
 class TestConnect:
     def test_connection(self, sftp):
         assert sftp is not None
@@ -226,7 +302,6 @@ class TestConnect:
         assert isinstance(entries, list)
 
 
-@_skip_sftp
 class TestWalkRemote:
     def test_walk_returns_list(self, sftp):
         # Bounded walk with max_depth=1 to avoid traversing the whole filesystem